@@ -0,0 +1,121 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncEngine:
+    """
+    asyncio driver for DBConnector's create and update actions.
+    Keeps up to `in_flight` WSAPI page requests running while completed pages are written to
+    postgres in page order. The bounded queue between the two sides is the backpressure:
+    when the writer falls behind, no new page requests are issued.
+    The tables written are the same as with the synchronous engine, since the rows are
+    produced by the same codecs and written by the same DBConnector writer functions.
+    """
+    def __init__(self, dbconnector, in_flight=4):
+        self.dbconnector = dbconnector
+        self.in_flight   = max(1, in_flight)
+
+    def run(self, action):
+        loop = asyncio.new_event_loop()
+        try:
+            entities = self.dbconnector.entities
+            if action == 'create':
+                entities = self.dbconnector.create_tables_n_columns()
+            self.dbconnector.ensure_sync_state()
+            loop.run_until_complete(self.sync_all(loop, action, entities))
+            if action == 'update' and self.dbconnector.config['db'].get('reconcile_deletes', False):
+                self.dbconnector.reconcile_deletes()
+        finally:
+            loop.close()
+
+    async def sync_all(self, loop, action, entities):
+        # entities are independent tables, each synced on its own pooled connection: no more of them
+        # run at a time than the pool has connections, so none waits for one into the pool timeout
+        slots = asyncio.Semaphore(self.dbconnector.pool.maxconn)
+
+        async def sync(entity):
+            async with slots:
+                await self.sync_entity(loop, action, entity)
+
+        # every entity runs to its end (and returns its connection) before the loop is closed;
+        # the first failure is raised after that
+        results = await asyncio.gather(*[sync(entity) for entity in entities], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def fetch_page(self, entity, start):
+        # one WSAPI request for the page starting at `start` (1-based), returned as encoded rows
+        dbc = self.dbconnector
+        codec = dbc.codecs[entity]
+        received = dbc.source.received.get(entity, 0)
+        with dbc.metrics.timer(entity, 'fetch'):
+            total, raws = dbc.source.page(entity, codec, dbc.query_for(entity), start)
+        dbc.metrics.count(entity, 'pages_fetched')
+        dbc.metrics.count(entity, 'items_seen', len(raws))
+        dbc.metrics.count(entity, 'bytes_received', dbc.source.received.get(entity, 0) - received)
+        watermark = dbc.watermarks.get(entity)
+        if watermark:
+            watermark.observe(codec, raws)
+        with dbc.metrics.timer(entity, 'encode'):
+            rows = [codec.convert(raw) for raw in raws]
+        return total, rows
+
+    def timed(self, entity, stage, function, *args):
+        with self.dbconnector.metrics.timer(entity, stage):
+            return function(*args)
+
+    async def sync_entity(self, loop, action, entity):
+        dbc = self.dbconnector
+        fetcher = ThreadPoolExecutor(max_workers=self.in_flight)
+        # a psycopg2 connection is used from one thread at a time: all writes of an entity go through one thread
+        writer_thread = ThreadPoolExecutor(max_workers=1)
+        pages = asyncio.Queue(maxsize=self.in_flight)
+        requested = []
+
+        def request(start):
+            requested.append(loop.run_in_executor(fetcher, self.fetch_page, entity, start))
+            return requested[-1]
+
+        async def produce():
+            try:
+                first = loop.create_future()
+                first.set_result(await request(1))
+                await pages.put(first)
+                total = first.result()[0]
+                for start in range(1 + dbc.pagesize, total + 1, dbc.pagesize):
+                    # put() waits while `in_flight` pages are already requested but not yet written
+                    await pages.put(request(start))
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                failed = loop.create_future()
+                failed.set_exception(ex)
+                await pages.put(failed)
+            await pages.put(None)
+
+        db = await loop.run_in_executor(writer_thread, dbc.pool.getconn)
+        producer = None
+        try:
+            cursor = db.cursor()
+            # the writer is prepared first: it decides the query (sync watermark) the pages are fetched with
+            write = await loop.run_in_executor(writer_thread, dbc.writer, action, cursor, entity)
+            producer = loop.create_task(produce())
+            while True:
+                page = await pages.get()
+                if page is None:
+                    break
+                total, rows = await page
+                if rows:
+                    await loop.run_in_executor(writer_thread, self.timed, entity, 'write', write, rows)
+            await loop.run_in_executor(writer_thread, dbc.finish, action, cursor, entity)
+            await loop.run_in_executor(writer_thread, self.timed, entity, 'commit', db.commit)
+        finally:
+            if producer and not producer.done():
+                producer.cancel()
+            # the page requests still running are waited for, so none completes on a closed loop
+            await asyncio.gather(*([producer] if producer else []) + requested, return_exceptions=True)
+            # putconn rolls back whatever was not committed
+            await loop.run_in_executor(writer_thread, dbc.pool.putconn, db)
+            fetcher.shutdown(wait=False)
+            writer_thread.shutdown(wait=False)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+##########################################################################################
+#
+# benchmark  -- create and update throughput of the connector on synthetic data
+#
+USAGE = """
+Usage: python benchmark.py <config_file.yml> [--items N] [--fields N] [--types STRING=4,QUANTITY=2,...]
+                           [--changes 0,1,10,50] [--engine sync|async] [--set db.load=copy ...] [--out results.json]
+
+       Runs create, then one update per --changes percentage (items changed since the previous run)
+       against the database of the config file, on a synthetic BenchItem entity, and writes the
+       rows/sec, SQL round trips, peak RSS and wall time of every run as JSON.
+       Only the benchitem* tables are dropped and created. No AC connection is made.
+"""
+##########################################################################################
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import threading
+import contextlib
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+from psycopg2 import extensions
+from dbpool import ConnectionPool
+from dbconnector import DBConnector, read_config
+from dbconnector_runner import perform, parse_options
+from schema_cache import Attribute, TypeDef
+
+ENTITY = 'BenchItem'
+TYPES  = ('STRING', 'QUANTITY', 'INTEGER', 'DATE', 'BOOLEAN', 'STATE', 'RATING')
+MIX    = 'STRING=4,QUANTITY=2,INTEGER=1,DATE=1,BOOLEAN=1,STATE=1,RATING=1'
+LABELS = ('Defined', 'In-Progress', 'Completed', 'Accepted', 'Released')
+EPOCH  = datetime(2016, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_mix(mix):
+    # 'STRING=4,QUANTITY=2' -> [('STRING', 4), ('QUANTITY', 2)]
+    weights = []
+    for part in mix.split(','):
+        type, _, weight = part.partition('=')
+        type = type.strip().upper()
+        if type not in TYPES:
+            raise ValueError("%s is not one of %s" % (type, ', '.join(TYPES)))
+        weights.append((type, int(weight or 1)))
+    return weights
+
+def field_types(fields, mix):
+    # `fields` attribute types spread over the mix in proportion to the weights
+    weights = parse_mix(mix)
+    cycle = [type for type, weight in weights for _ in range(weight)]
+    return [cycle[index % len(cycle)] for index in range(fields)]
+
+
+class SyntheticSource:
+    """
+    A source (see sources.py) generating the BenchItem typedef and its items: ObjectID, Name,
+    CreationDate, LastUpdateDate and `fields` attributes of the types of `mix`. Before phase p
+    (1, 2 ...) the fraction changes[p - 1] of the items is changed: their Name and every generated
+    value move to the next revision. Values are derived from (ObjectID, revision, attribute), so
+    every process generating a phase sees the same items.
+    """
+    decodes = True
+
+    def __init__(self, items=10000, fields=10, mix=MIX, changes=(), phase=0, seed=1, pagesize=200):
+        self.count    = items
+        self.types    = field_types(fields, mix)
+        self.names    = ['c_Bench%s%d' % (type.capitalize(), index) for index, type in enumerate(self.types)]
+        self.pagesize = pagesize
+        self.received = {}
+        self.revisions = [0] * items
+        for index, rate in enumerate(changes[:phase]):
+            for changed in random.Random(seed * 1000 + index).sample(range(items), int(round(items * rate))):
+                self.revisions[changed] += 1
+        self.strings  = ['%s %s' % (word, 'x' * (index % 24)) for index, word in
+                         enumerate(['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta'] * 8)]
+
+    def typedef(self, entity, refresh=False):
+        attributes = [Attribute('ObjectID', 'INTEGER'), Attribute('Name', 'STRING'),
+                      Attribute('CreationDate', 'DATE'), Attribute('LastUpdateDate', 'DATE')]
+        attributes += [Attribute(name, type, True, type in ('STATE', 'RATING'), False,
+                                 LABELS if type in ('STATE', 'RATING') else ())
+                       for name, type in zip(self.names, self.types)]
+        return TypeDef(entity, attributes)
+
+    def fields(self):
+        # the names of all attributes, to be fetched (ac.fetch)
+        return ['ObjectID', 'Name', 'CreationDate', 'LastUpdateDate'] + self.names
+
+    def value(self, type, key):
+        if type == 'STRING':
+            return self.strings[key % len(self.strings)]
+        if type == 'QUANTITY':
+            return float(key % 40) / 2
+        if type == 'INTEGER':
+            return key % 100000
+        if type == 'DATE':
+            return (EPOCH + timedelta(seconds=key % 31536000)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        if type == 'BOOLEAN':
+            return key % 2 == 0
+        return LABELS[key % len(LABELS)]
+
+    def item(self, index):
+        # the WSAPI JSON form of the item
+        oid, revision = 1000 + index * 10, self.revisions[index]
+        result = {'ObjectID': oid, 'Name': 'item %d rev %d' % (oid, revision),
+                  'CreationDate': (EPOCH + timedelta(minutes=index)).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                  'LastUpdateDate': (EPOCH + timedelta(days=revision, minutes=index)).strftime('%Y-%m-%dT%H:%M:%S.000Z')}
+        for attribute, (name, type) in enumerate(zip(self.names, self.types)):
+            result[name] = self.value(type, index * 7919 + revision * 104729 + attribute * 31)
+        return result
+
+    def items(self, entity, codec, query):
+        decode = codec.decode_json
+        for index in range(self.count):
+            yield decode(self.item(index))
+
+    def page(self, entity, codec, query, start):
+        indexes = range(start - 1, min(start - 1 + self.pagesize, self.count))
+        return self.count, [codec.decode_json(self.item(index)) for index in indexes]
+
+    def objectids(self, entity, query):
+        return iter(range(1000, 1000 + self.count * 10, 10))
+
+
+class RoundTrips:
+    # statements, COPYs, commits and rollbacks sent to postgres by the process
+    lock  = threading.Lock()
+    count = 0
+
+    @classmethod
+    def add(cls, count=1):
+        with cls.lock:
+            cls.count += count
+
+
+class CountingCursor(extensions.cursor):
+    def execute(self, query, vars=None):
+        RoundTrips.add()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        # psycopg2 sends one statement per parameter set
+        vars_list = list(vars_list)
+        RoundTrips.add(len(vars_list))
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        RoundTrips.add()
+        return super().copy_expert(sql, file, size)
+
+
+class CountingConnection(extensions.connection):
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        RoundTrips.add()
+        return super().commit()
+
+    def rollback(self):
+        RoundTrips.add()
+        return super().rollback()
+
+
+class BenchConnector(DBConnector):
+    """
+    DBConnector on a SyntheticSource, counting the round trips of its connections.
+    """
+    def __init__(self, config, source):
+        self.synthetic = source
+        DBConnector.__init__(self, config, entities=[ENTITY])
+
+    def read_config(self, config):
+        return config
+
+    def connect_source(self):
+        return self.synthetic
+
+    def connect_db(self):
+        return ConnectionPool.from_config(self.config['db'], connection_factory=CountingConnection)
+
+
+def bench_config(config, source, overrides):
+    # the config file with the synthetic entity, no AC connection, and the --set overrides
+    config = json.loads(json.dumps(config))
+    config['ac'].update({'source': 'replay', 'fetch': ','.join(source.fields()), 'query': None,
+                         'incremental': False, 'schema_cache': ''})
+    config['db']['tables'] = ENTITY
+    config['db']['workers'] = 1
+    for override in overrides:
+        path, _, value = override.partition('=')
+        section = config
+        keys = path.split('.')
+        for key in keys[:-1]:
+            section = section.setdefault(key, {})
+        section[keys[-1]] = yaml.safe_load(value)
+    return config
+
+def written(dbconnector):
+    # (versions, closed versions) of the entity, none before it is created
+    versions = closed = 0
+    with dbconnector.pool.connection() as db:
+        cursor = db.cursor()
+        for table in dbconnector.tables(ENTITY):
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+            if not cursor.fetchone()[0]:
+                continue
+            cursor.execute("SELECT count(*), count(_end) FROM %s" % table)
+            count, ended = cursor.fetchone()
+            versions, closed = versions + count, closed + ended
+        db.rollback()
+    return versions, closed
+
+def drop_tables(config):
+    # the tables, views and types of earlier benchmarks
+    pool = ConnectionPool.from_config(config['db'])
+    try:
+        with pool.connection(autocommit=True) as db:
+            cursor = db.cursor()
+            cursor.execute("SELECT relname FROM pg_class JOIN pg_namespace n ON n.oid = relnamespace "
+                           "WHERE nspname = 'public' AND relkind IN ('r', 'p', 'v') AND relname LIKE 'benchitem%' "
+                           "AND relispartition IS NOT TRUE")
+            for name, in cursor.fetchall():
+                cursor.execute("DROP TABLE IF EXISTS %s CASCADE" % name if not name.endswith('_decoded') else
+                               "DROP VIEW IF EXISTS %s CASCADE" % name)
+            cursor.execute("SELECT typname FROM pg_type WHERE typtype = 'e' AND typname LIKE 'benchitem%'")
+            for name, in cursor.fetchall():
+                cursor.execute("DROP TYPE IF EXISTS %s CASCADE" % name)
+    finally:
+        pool.closeall()
+
+def run_phase(config, params, phase, action):
+    """
+    One create or update in a process of its own, so the peak RSS is the run's. The connector's
+    own output goes to stderr, keeping stdout for the results.
+    """
+    source = SyntheticSource(params['items'], params['fields'], params['types'], params['changes'], phase,
+                             params['seed'], config['ac'].get('pagesize', 200))
+    with contextlib.redirect_stdout(sys.stderr):
+        dbconnector = BenchConnector(config, source)
+        try:
+            before = written(dbconnector)
+            RoundTrips.count = 0
+            started = time.perf_counter()
+            perform(dbconnector, action, parse_options(['--engine', params['engine']]))
+            wall = time.perf_counter() - started
+            trips = RoundTrips.count
+            after = written(dbconnector)
+        finally:
+            dbconnector.close()
+    rows = (after[0] - before[0]) + (after[1] - before[1])
+    return {
+        'action'          : action,
+        'changed_percent' : 100.0 * params['changes'][phase - 1] if phase else None,
+        'items'           : params['items'],
+        'rows_written'    : rows,
+        'rows_inserted'   : after[0] - before[0],
+        'rows_closed'     : after[1] - before[1],
+        'wall_seconds'    : round(wall, 4),
+        'items_per_second': round(params['items'] / wall, 1) if wall else None,
+        'rows_per_second' : round(rows / wall, 1) if wall else None,
+        'round_trips'     : trips,
+        'peak_rss_kb'     : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(prog='benchmark.py', usage=USAGE)
+    parser.add_argument('config')
+    parser.add_argument('--items', type=int, default=10000, help='number of synthetic items')
+    parser.add_argument('--fields', type=int, default=10, help='generated attributes besides ObjectID, Name and dates')
+    parser.add_argument('--types', default=MIX, help='type mix of the generated attributes, as TYPE=weight,...')
+    parser.add_argument('--changes', default='0,1,10,50', help='percent of the items changed before each update')
+    parser.add_argument('--engine', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='config override, e.g. --set db.load=copy --set db.update=merge')
+    parser.add_argument('--out', help='write the results to this file instead of stdout')
+    return parser.parse_args(args)
+
+def main(args):
+    options = parse_args(args)
+    params = {'items': options.items, 'fields': options.fields, 'types': options.types, 'seed': options.seed,
+              'engine': options.engine,
+              'changes': [float(change) / 100 for change in options.changes.split(',') if change.strip()]}
+    field_types(params['fields'], params['types'])   # fails early on an unknown type
+    config = bench_config(read_config(options.config), SyntheticSource(1, params['fields'], params['types']),
+                          options.set)
+    drop_tables(config)
+    started = datetime.now(timezone.utc).isoformat()
+    results = []
+    phases = [(0, 'create')] + [(phase, 'update') for phase in range(1, len(params['changes']) + 1)]
+    for phase, action in phases:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(run_phase, config, params, phase, action).result()
+        sys.stderr.write('%-6s %6s%%  %8d rows %9.3fs %10.1f items/s %8d round trips\n' %
+                         (action, result['changed_percent'] if phase else '-', result['rows_written'],
+                          result['wall_seconds'], result['items_per_second'] or 0, result['round_trips']))
+        results.append(result)
+    report = {'benchmark': 'ac2postgres', 'started': started,
+              'python': platform.python_version(), 'parameters': params, 'overrides': options.set,
+              'results': results}
+    if options.out:
+        with open(options.out, 'w') as out:
+            json.dump(report, out, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
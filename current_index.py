@@ -0,0 +1,69 @@
+from array import array
+from bisect import bisect_left
+
+UNCHANGED, CHANGED, NEW = 0, 1, 2
+DIGEST = 16   # md5 fingerprint size
+
+
+class CurrentIndex:
+    """
+    ObjectID -> (id, _fingerprint) of the current versions (_end IS NULL) of one entity,
+    loaded with a single server-side cursor query ordered by ObjectID and kept in flat
+    arrays (8 + 8 + 16 bytes per item), so millions of items fit in a few dozen MB.
+    Lookups are a merge-join: the WSAPI stream is ordered by ObjectID too, so the position
+    of the previous lookup only moves forward.
+    """
+    def __init__(self, entity):
+        self.entity       = entity
+        self.oids         = array('q')
+        self.ids          = array('q')
+        self.fingerprints = bytearray()
+        self.pos          = 0
+        self.last_new     = None    # the last ObjectID not in the index, to drop repeats of it
+        self.new          = 0
+        self.changed      = 0
+
+    @classmethod
+    def load(cls, connection, entity, itersize=50000, current="_end IS NULL"):
+        index = cls(entity)
+        cursor = connection.cursor(name='current_%s' % entity)
+        cursor.itersize = itersize
+        cursor.execute("SELECT ObjectID, id, _fingerprint FROM %s WHERE %s ORDER BY ObjectID" % (entity, current))
+        empty = bytes(DIGEST)
+        for oid, id, digest in cursor:
+            index.oids.append(oid)
+            index.ids.append(id)
+            index.fingerprints += digest if digest is not None else empty
+        cursor.close()
+        return index
+
+    def __len__(self):
+        return len(self.oids)
+
+    def find(self, oid):
+        oids = self.oids
+        # moving forward from the last match; an ObjectID behind it (out of order stream) restarts the search
+        low = self.pos if self.pos == 0 or oids[self.pos - 1] < oid else 0
+        i = bisect_left(oids, oid, low)
+        self.pos = i
+        return i if i < len(oids) and oids[i] == oid else -1
+
+    def diff(self, oid, digest):
+        # returns (status, id of the current version to close)
+        i = self.find(oid)
+        if i < 0:
+            # the stream is ordered by ObjectID, so an item repeated across pages follows itself
+            if oid == self.last_new:
+                return UNCHANGED, None
+            self.last_new = oid
+            self.new += 1
+            return NEW, None
+        offset = i * DIGEST
+        if self.ids[i] == 0 or self.fingerprints[offset:offset + DIGEST] == digest:
+            # unchanged, or already replaced by a new version earlier in this run
+            return UNCHANGED, None
+        id = self.ids[i]
+        self.ids[i] = 0
+        self.fingerprints[offset:offset + DIGEST] = digest
+        self.changed += 1
+        return CHANGED, id
@@ -1,26 +1,61 @@
+import io
+import os
 import sys
+import json
+import logging
+import itertools
 import requests
-import psycopg2
 from psycopg2.extensions import AsIs
 import yaml
 from pyral import Rally, rallyWorkset, RallyRESTAPIError
 from datetime import datetime, timezone
+from rowcodec import RowCodec, copy_escape, fingerprint, parse_date
+from pipeline import Pipeline
+from dbpool import ConnectionPool
+from current_index import CurrentIndex, UNCHANGED
+from sync_state import ensure_sync_state, load_watermark, reset_watermark, save_watermark
+from tombstones import anti_join, batched
+from lookback import LookbackSource, SnapshotFileSource, snapshot_versions, hydrated
+from schema_cache import TypedefCache, TypeDef
+from schema_planner import SchemaPlanner, Column, COLUMN_TYPES, SYSTEM_COLUMNS, PARTITIONED_SYSTEM_COLUMNS, enum_name, lookup_name
+from partitions import Partitions, KEY
+from split_layout import split_statements, move_deleted_sql
+from export import ParquetExport
+from wsapi_json import WsapiJson
+from sources import WsapiSource, ReplaySource, page_files, write_page, META
+from metrics import Metrics
+
+log = logging.getLogger(__name__)
+
+def read_config(config_name):
+    with open(config_name, 'r') as file:
+        config = yaml.safe_load(file)
+    return config
+
+def configured_entities(config):
+    return config['db']['tables'].replace(',','').split()
 
 class DBConnector:
-    def __init__(self, config):
+    def __init__(self, config, entities=None):
         self.config     = self.read_config(config)
-        self.ac         = self.connect_ac()
-        self.db         = self.connect_db()
-        self.cursor     = self.db.cursor()
-        self.entities   = self.config['db']['tables'].replace(',','').split()
+        self.pagesize   = self.config['ac'].get('pagesize', 200)
+        self.max_pages  = self.config['ac'].get('max_pages', 4)
+        self.shards     = self.config['ac'].get('shards', 1)
+        self.ac         = self.connect_ac() if self.source_type() == 'wsapi' else None
+        self.source     = self.connect_source()
+        self.pool       = self.connect_db()
+        self.entities   = entities or configured_entities(self.config)
         self.schema     = self.get_schema()
+        self.partitions = Partitions.from_config(self.config['db'])
+        self.metrics    = Metrics()
+        self.full       = False   # --full: ignore the sync watermarks and fetch everything matching ac.query
+        self.watermarks = {}
         self.columns = {}
+        self.codecs  = {}
         self.cache_columns()
 
     def read_config(self, config_name):
-        with open(config_name, 'r') as file:
-            config = yaml.load(file)
-        return config
+        return read_config(config_name)
 
     def connect_ac(self):
         errout    = sys.stderr.write
@@ -40,47 +75,61 @@ class DBConnector:
             sys.exit(1)
 
 
+    def source_type(self):
+        # ac.source: wsapi (AC itself) or replay (pages recorded by the record action, see ReplaySource)
+        source = self.config['ac'].get('source', 'wsapi')
+        if source not in ('wsapi', 'replay'):
+            sys.stderr.write("ac.source must be wsapi or replay, not %s\n" % source)
+            sys.exit(1)
+        return source
+
+    def connect_wsapi(self):
+        # ac.backend: json reads the items from the WSAPI JSON on the pyral session, see WsapiJson
+        backend = self.config['ac'].get('backend', 'pyral')
+        if backend not in ('pyral', 'json'):
+            sys.stderr.write("ac.backend must be pyral or json, not %s\n" % backend)
+            sys.exit(1)
+        return WsapiJson(self.ac) if backend == 'json' else None
+
+    def connect_source(self):
+        # where the typedefs and items come from; everything downstream is the same for every source
+        if self.source_type() == 'replay':
+            return ReplaySource(self.replay_directory(), self.pagesize)
+        return WsapiSource(self.ac, self.connect_wsapi(), self.typedef_cache(), self.shards,
+                           self.config['ac'].get('shard_concurrency', 4), self.pagesize, self.max_pages)
+
+    def replay_directory(self):
+        return os.path.expanduser((self.config.get('replay') or {}).get('directory', 'recorded'))
+
     def connect_db(self):
         errout = sys.stderr.write
 
         try:
-            db = psycopg2.connect(database=self.config['db']['name'], user=self.config['db']['user'],
-                password=self.config['db']['password'], host=self.config['db']['host'], port=self.config['db']['port'])
-            return db
+            return ConnectionPool.from_config(self.config['db'])
         except Exception as ex:
             errout(str(ex.args[0]))
             sys.exit(1)
 
 
-    def get_schema(self):
-        workitems_meta = []
-        for entity in self.entities:
-            workitems_meta.append(self.ac.typedef(entity))
-        return workitems_meta
+    def close(self):
+        self.pool.closeall()
+
+    def typedef_cache(self):
+        directory = self.config['ac'].get('schema_cache', '~/.ac2postgres/schema')
+        if not directory:
+            return None
+        return TypedefCache(directory, str(self.config['ac']['workspace']), self.config['ac'].get('schema_ttl', 86400))
+
+    def get_schema(self, refresh=False):
+        return [self.source.typedef(entity, refresh) for entity in self.entities]
+
+    def refresh_schema(self):
+        # run.py ... --refresh-schema: fetch the typedefs again and rewrite the cache
+        self.schema = self.get_schema(refresh=True)
+        self.cache_columns()
 
     def matchTypes(self,rally_type):
-        return {
-            'INTEGER' : 'bigint',
-            'DATE'    : 'timestamp with time zone',
-            'BOOLEAN' : 'boolean default false',
-            'QUANTITY': 'double precision',  # e.g. Rally PlanEstimate's AttributeType: "QUANTITY"
-            'STRING'  : 'text'
-        }[rally_type]
-
-    def convert_list_to_string_of_quoted_items(self, values):
-        # Example of a list received as arg to this method:
-        # ['Submitted', 'Open', 'Fixed', 'Closed']
-        #
-        # Example of a string that we need to pass to
-        # ADD COLUMN %s text check (%s IN (%s) to populate IN (%s):
-        # 'Submitted','Open','Fixed','Closed'
-
-        str = ""
-        for i, item in enumerate(values):
-            str += "'" + item + "'"
-            if i < len(values) - 1:
-                str += ','
-        return str
+        return COLUMN_TYPES[rally_type]
 
     def attributes_subset(self, element):
         found = element.ElementName in self.config["ac"]["fetch"]
@@ -91,130 +140,422 @@ class DBConnector:
             attributes = list(filter(self.attributes_subset, itemtype.Attributes))
             table_name = itemtype.ElementName
             self.columns[table_name] = [{attr.ElementName: attr.AttributeType} for attr in attributes ]
+            self.codecs[table_name]  = RowCodec(table_name, self.columns[table_name])
+
+    def enum_storage(self):
+        # how STATE and RATING columns are stored: check (text with a CHECK constraint), enum (a postgres
+        # ENUM type per attribute) or lookup (smallint ids into <table>_<attribute>_values)
+        return self.config['db'].get('enum_storage', 'check')
+
+    def layout(self):
+        # versions: all versions of an entity in one table, the current ones with _end IS NULL;
+        # split: the current version of each item in <entity>, the closed ones in <entity>_history
+        return self.config['db'].get('layout', 'versions')
+
+    def history_table(self, entity):
+        # the table closed versions are written to
+        return '%s_history' % entity if self.layout() == 'split' else entity
+
+    def tables(self, entity):
+        return [entity, self.history_table(entity)] if self.layout() == 'split' else [entity]
+
+    def table_columns(self, itemtype, partitioned=False):
+        system = PARTITIONED_SYSTEM_COLUMNS if partitioned else SYSTEM_COLUMNS
+        columns = [Column(name, type) for name, type in system]
+        storage = self.enum_storage()
+        for attr in filter(self.attributes_subset, itemtype.Attributes):
+            if attr.AttributeType in ('STATE', 'RATING'):
+                type = {'check': 'text', 'enum': enum_name(itemtype.ElementName, attr.ElementName),
+                        'lookup': 'smallint'}[storage]
+                columns.append(Column(attr.ElementName, type, [a.StringValue for a in attr.AllowedValues], storage,
+                                      itemtype.ElementName))
+            else:
+                columns.append(Column(attr.ElementName, self.matchTypes(attr.AttributeType)))
+        return columns
 
     def create_tables_n_columns(self):
-        for itemtype in self.schema:
-            attributes = list(filter(self.attributes_subset, itemtype.Attributes))
-            table_name = itemtype.ElementName
-            #populate list of dictionaries of column_name:type, e.g.
-            # [{'CreationDate': 'DATE'}, {'ObjectID': 'INTEGER'}, {'ScheduleState': 'STATE'}]
-            #self.columns[table_name] = [{attr.ElementName: attr.AttributeType} for attr in attributes ]
-            self.cursor.execute("CREATE TABLE %s ();", (AsIs(table_name),))
-            self.cursor.execute("ALTER TABLE %s ADD COLUMN ID SERIAL PRIMARY KEY;",(AsIs(table_name),))
-            self.cursor.execute("ALTER TABLE %s ADD COLUMN _start TIME WITH TIME ZONE;", (AsIs(table_name),))
-            self.cursor.execute("ALTER TABLE %s ADD COLUMN _end TIME WITH TIME ZONE;", (AsIs(table_name),))
-            for attr in attributes:
-                element_name = attr.ElementName
-                attribute_type = attr.AttributeType
-                allowed_values = attr.AllowedValues
-
-                print('-' + element_name)
-                print('---' + attribute_type)
-
-                if attr.AttributeType == 'RATING':
-                    rating_allowed_values = [a.StringValue for a in allowed_values]
-                    self.cursor.execute("ALTER TABLE %s ADD COLUMN %s text check (%s IN (%s)) ",
-                                (AsIs(table_name), AsIs(element_name), AsIs(element_name),
-                                 (AsIs(self.convert_list_to_string_of_quoted_items(rating_allowed_values))),))
-                elif attr.AttributeType == 'STATE':
-                    state_allowed_values = [a.StringValue for a in allowed_values]
-                    self.cursor.execute("ALTER TABLE %s ADD COLUMN %s text check (%s IN (%s)) ",
-                                (AsIs(table_name), AsIs(element_name), AsIs(element_name),
-                                 (AsIs(self.convert_list_to_string_of_quoted_items(state_allowed_values))),))
-                else:
-                    self.cursor.execute("ALTER TABLE %s ADD COLUMN %s %s",
-                                (AsIs(table_name), AsIs(element_name), (AsIs(self.matchTypes(attribute_type))),))
-
-
-            self.db.commit()
-
-    def insert_init_data(self):
+        # brings the tables to the typedefs and ac.fetch: CREATE TABLE for new entities, only the missing
+        # columns, type widenings and CHECK changes for existing ones, all in one transaction.
+        # Returns the entities whose tables were created.
+        created = []
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            planner = SchemaPlanner(cursor)
+            for itemtype in self.schema:
+                table_name = itemtype.ElementName
+                split = self.layout() == 'split'
+                history = self.history_table(table_name)
+                for table in self.tables(table_name):
+                    # with the split layout only the history is partitioned, the current table is unique on ObjectID
+                    partitioned = bool(self.partitions) and table == history
+                    statements, new = planner.plan(table, self.table_columns(itemtype, partitioned),
+                                                   KEY if partitioned else None, 'ObjectID' if split and table != history else None)
+                    for statement in statements:
+                        log.info(statement)
+                        cursor.execute(statement)
+                    if partitioned and not new and not self.partitions.is_partitioned(cursor, table):
+                        log.warning("%s was created before db.partition was set and stays unpartitioned", table)
+                    if table == table_name and new:
+                        created.append(table_name)
+                        cursor.execute("COMMENT ON COLUMN %s._fingerprint IS %s", (AsIs(table), self.codecs[table_name].columns,))
+                    if not split:
+                        # current versions are looked up by ObjectID on every update
+                        cursor.execute("CREATE INDEX IF NOT EXISTS %s_current ON %s (ObjectID) WHERE _end IS NULL",
+                                       (AsIs(table), AsIs(table),))
+                    # versions valid at a moment, see as_of
+                    cursor.execute("CREATE INDEX IF NOT EXISTS %s_valid ON %s USING gist (_valid)", (AsIs(table), AsIs(table),))
+                self.ensure_partitions(cursor, table_name)
+            db.commit()
+        return created
+
+    def query_for(self, entity):
+        # with ac.incremental the configured query is narrowed to items changed since the last sync
         query = self.config['ac']['query']
+        watermark = self.watermarks.get(entity)
+        if watermark is None or self.full or not self.config['ac'].get('incremental', True):
+            return query
+        return watermark.query(query, self.config['ac'].get('watermark_overlap', 300))
+
+    def fetch_items(self, entity):
+        return self.source.items(entity, self.codecs[entity], self.query_for(entity))
+
+    def run_pipeline(self, entity, write):
+        pipeline = Pipeline(entity, self.codecs[entity], self.pagesize, self.max_pages)
+        watermark = self.watermarks.get(entity)
+        received = self.source.received.get(entity, 0)
+        try:
+            pipeline.run(self.fetch_items(entity), write, watermark.observe if watermark else None,
+                         self.source.decodes)
+        finally:
+            self.metrics.count(entity, 'pages_fetched', pipeline.pages)
+            self.metrics.count(entity, 'items_seen', pipeline.stats[0].items)
+            self.metrics.count(entity, 'bytes_received', self.source.received.get(entity, 0) - received)
+            for stage in pipeline.stats:
+                self.metrics.time(entity, stage.name, stage.seconds)
+        pipeline.report()
+
+    def ensure_partitions(self, cursor, entity):
+        # the partitions for the versions written from now on, created ahead of need
+        table = self.history_table(entity)
+        if self.partitions and self.partitions.is_partitioned(cursor, table):
+            self.partitions.ensure(cursor, table)
+
+    def detach_partitions(self):
+        # run.py config.yml detach: partitions older than db.partition.keep months become standalone tables
         for entity in self.entities:
-            fields = [k for column in self.columns[entity] for k,v in column.items()]
-            fetch = ','.join(fields)
-            response = self.ac.get('%s' % entity, fetch=fetch, query=query, order="ObjectID", pagesize=200)
-            for item in response:
-                field_values = []
-                formatters = ""
-                empty_fields = []
-                for field in fields:
-                    value = getattr(item, field)
-                    # RATING   type e.g. Severity     when empty return 'None'.
-                    # QUANTITY type e.g. PlanEstimate when empty return None
-                    if not value or value == 'None':
-                        empty_fields.append(field)
-                    else:
-                        formatters = formatters + "%s,"
-                        number_fields = [k for column in self.columns[entity] for k,v in column.items() if 'INTEGER' in column.values() or 'QUANTITY' in column.values()]
-                        if field not in number_fields and field != 'None':
-                            value = "'" + value + "'"
-                        field_values.append(value)
-                non_empty_fields = fields[:]
-                for field in empty_fields:
-                    non_empty_fields.remove(field)
-                columns = ','.join(non_empty_fields)
-                formatters = formatters[:-1] #remove trailing comma
-                expression = "VALUES (%s)" % formatters % tuple(field_values)
-                self.cursor.execute("INSERT INTO %s (%s) %s", (AsIs(entity), AsIs(columns), AsIs(expression),))
-            self.cursor.execute("UPDATE %s SET _start = %s", (AsIs(entity), datetime.now(timezone.utc),))
-        self.db.commit()
-        self.db.close()
+            with self.pool.connection() as db:
+                cursor = db.cursor()
+                table = self.history_table(entity)
+                if not self.partitions or not self.partitions.is_partitioned(cursor, table):
+                    log.info("%s: not partitioned", table)
+                    continue
+                detached = self.partitions.detach(cursor, table)
+                db.commit()
+                log.info("%s: detached %s", entity, ', '.join(detached) or 'nothing', extra={'entity': entity})
+
+    def use_lookups(self, cursor, entity):
+        # with lookup storage the codec writes the ids of STATE and RATING labels, read from the lookup tables
+        if self.enum_storage() != 'lookup':
+            return
+        encodings = {}
+        for field, type in zip(self.codecs[entity].fields, self.codecs[entity].types):
+            if type in ('STATE', 'RATING'):
+                cursor.execute("SELECT value, id FROM %s", (AsIs(lookup_name(entity, field)),))
+                encodings[field] = dict(cursor.fetchall())
+        self.codecs[entity] = RowCodec(entity, self.columns[entity], encodings)
+
+    def copy_rows(self, cursor, entity, rows):
+        # bulk load: every page of the AC response is written with one COPY ... FROM STDIN
+        # instead of one INSERT per work item
+        codec = self.codecs[entity]
+        start = datetime.now(timezone.utc)
+        page = io.StringIO(''.join([codec.copy_line(row, codec.fingerprint(row), start) for row in rows]))
+        cursor.copy_expert("COPY %s (%s,_fingerprint,_start) FROM STDIN" % (entity, codec.columns), page)
+        self.metrics.count(entity, 'rows_inserted', len(rows))
+
+    def insert_rows(self, cursor, entity, rows):
+        codec = self.codecs[entity]
+        cursor.executemany(codec.insert_sql, [codec.params(row) for row in rows])
+        self.metrics.count(entity, 'rows_inserted', len(rows))
+
+    def writer(self, action, cursor, entity):
+        # the function that writes one page of encoded rows of an entity for the given action
+        # create loads a new table in full, so the watermark of a table dropped since is not applied
+        self.watermarks[entity] = reset_watermark(cursor, entity) if action == 'create' else \
+                                  load_watermark(cursor, entity)
+        self.ensure_partitions(cursor, entity)
+        self.use_lookups(cursor, entity)
+        if action == 'update':
+            self.ensure_fingerprints(cursor, entity)
+        if action == 'update' and (self.config['db'].get('update', 'rows') == 'merge' or self.layout() == 'split'):
+            statements = self.prepare_stage(cursor, entity)
+            return lambda rows: self.merge_rows(cursor, entity, statements, rows)
+        if action == 'update':
+            index = CurrentIndex.load(cursor.connection, entity)
+            return lambda rows: self.update_rows(cursor, entity, index, rows)
+        if self.config['db'].get('load', 'insert') == 'copy':
+            return lambda rows: self.copy_rows(cursor, entity, rows)
+        return lambda rows: self.insert_rows(cursor, entity, rows)
+
+    def finish(self, action, cursor, entity):
+        if action == 'create' and self.config['db'].get('load', 'insert') != 'copy':
+            cursor.execute("UPDATE %s SET _start = %s", (AsIs(entity), datetime.now(timezone.utc),))
+        save_watermark(cursor, self.watermarks[entity])
+
+    def ensure_sync_state(self):
+        with self.pool.connection(autocommit=True) as db:
+            ensure_sync_state(db.cursor())
+
+    def sync(self, action, entities=None):
+        self.ensure_sync_state()
+        for entity in self.entities if entities is None else entities:
+            # one pooled connection and one transaction per entity, so a failure in a later
+            # entity does not roll back the earlier ones
+            with self.pool.connection() as db:
+                cursor = db.cursor()
+                self.run_pipeline(entity, self.writer(action, cursor, entity))
+                self.finish(action, cursor, entity)
+                with self.metrics.timer(entity, 'commit'):
+                    db.commit()
+
+    def insert_init_data(self, entities=None):
+        self.sync('create', entities)
+
+    def ensure_fingerprints(self, cursor, entity):
+        # the column list the stored fingerprints were computed from is kept as the comment of _fingerprint
+        codec = self.codecs[entity]
+        cursor.execute("ALTER TABLE %s ADD COLUMN IF NOT EXISTS _fingerprint bytea", (AsIs(entity),))
+        cursor.execute("SELECT col_description(attrelid, attnum) FROM pg_attribute "
+                       "WHERE attrelid = %s::regclass AND attname = '_fingerprint'", (entity,))
+        if cursor.fetchone()[0] == codec.columns:
+            return
+        for table in self.tables(entity):
+            self.recompute_fingerprints(cursor, entity, table)
+        cursor.execute("COMMENT ON COLUMN %s._fingerprint IS %s", (AsIs(entity), codec.columns,))
+
+    def recompute_fingerprints(self, cursor, entity, table=None, batch=10000):
+        # ac.fetch changed since the fingerprints were written: recompute them for every version,
+        # streaming the rows through a server-side cursor and writing back one batch at a time
+        table = table or entity
+        log.info("recomputing %s fingerprints for %s", table, self.codecs[entity].columns, extra={'entity': entity})
+        codec = self.codecs[entity]
+        rows = cursor.connection.cursor(name='fingerprints_%s' % table)
+        rows.itersize = batch
+        # fingerprints are of the labels, which the decoded view has in place of lookup ids
+        source = '%s_decoded' % table if self.enum_storage() == 'lookup' else table
+        rows.execute("SELECT id, %s FROM %s" % (codec.columns, source))
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS _fingerprints (id integer, fingerprint bytea) ON COMMIT DROP")
+        while True:
+            fetched = rows.fetchmany(batch)
+            if not fetched:
+                break
+            page = io.StringIO(''.join(['%s\t%s\n' % (row[0], copy_escape(fingerprint(row[1:]))) for row in fetched]))
+            cursor.execute("TRUNCATE _fingerprints")
+            cursor.copy_expert("COPY _fingerprints (id, fingerprint) FROM STDIN", page)
+            cursor.execute("UPDATE %s t SET _fingerprint = f.fingerprint FROM _fingerprints f WHERE t.id = f.id",
+                           (AsIs(table),))
+        rows.close()
+
+    def update_rows(self, cursor, entity, index, rows):
+        # diff one page against the current-state index: no per-item queries, one UPDATE
+        # closing the changed versions and one COPY with their new versions and the new items
+        codec = self.codecs[entity]
+        records_to_set_end = []
+        new_rows = []
+        for row in rows:
+            status, id = index.diff(row[codec.oid], codec.fingerprint(row))
+            if status == UNCHANGED:
+                continue
+            if id is not None:
+                records_to_set_end.append(id)
+            new_rows.append(row)
+        if records_to_set_end:
+            cursor.execute("UPDATE %s SET _end = %s WHERE id = ANY(%s)",
+                           (AsIs(entity), datetime.now(timezone.utc), records_to_set_end,))
+            self.metrics.count(entity, 'items_changed', len(records_to_set_end))
+            self.metrics.count(entity, 'rows_closed', len(records_to_set_end))
+        if new_rows:
+            self.copy_rows(cursor, entity, new_rows)
+
+    def prepare_stage(self, cursor, entity):
+        # set-based update: each page is copied into a temporary staging table with the
+        # tracked columns of the entity, then merged with two statements
+        codec = self.codecs[entity]
+        stage = '_stage_%s' % entity
+        # recreated per sync: a pooled session may still hold a stage with an older column list
+        cursor.execute("DROP TABLE IF EXISTS pg_temp.%s", (AsIs(stage),))
+        cursor.execute("CREATE TEMP TABLE %s AS SELECT %s,_fingerprint FROM %s WITH NO DATA",
+                       (AsIs(stage), AsIs(codec.columns), AsIs(entity),))
+        if self.layout() == 'split':
+            return (stage,) + split_statements(entity, self.history_table(entity), codec, stage)
+        cursor.execute("CREATE INDEX IF NOT EXISTS %s_current ON %s (ObjectID) WHERE _end IS NULL",
+                       (AsIs(entity), AsIs(entity),))
+        # close the current version of every staged item whose tracked values differ
+        close_sql = ("UPDATE %s t SET _end = %%(now)s FROM %s s WHERE t._end IS NULL AND t.ObjectID = s.ObjectID "
+                     "AND t._fingerprint IS DISTINCT FROM s._fingerprint" % (entity, stage))
+        # items left without a current version are either the ones just closed or never seen before
+        insert_sql = ("INSERT INTO %s (%s,_fingerprint,_start) SELECT %s,s._fingerprint,%%(now)s FROM %s s WHERE NOT EXISTS "
+                      "(SELECT 1 FROM %s t WHERE t._end IS NULL AND t.ObjectID = s.ObjectID)" %
+                      (entity, codec.columns, ','.join(['s.%s' % field for field in codec.fields]), stage, entity))
+        return stage, close_sql, insert_sql
+
+    def merge_rows(self, cursor, entity, statements, rows):
+        stage, close_sql, insert_sql = statements
+        codec = self.codecs[entity]
+        cursor.execute("TRUNCATE %s", (AsIs(stage),))
+        page = io.StringIO(''.join([codec.copy_line(row, codec.fingerprint(row)) for row in rows]))
+        cursor.copy_expert("COPY %s (%s,_fingerprint) FROM STDIN" % (stage, codec.columns), page)
+        now = {'now': datetime.now(timezone.utc)}
+        # split layout: archiving the current version closes it, the upsert writes the new one
+        cursor.execute(close_sql, now)
+        self.metrics.count(entity, 'items_changed', cursor.rowcount)
+        self.metrics.count(entity, 'rows_closed', cursor.rowcount)
+        cursor.execute(insert_sql, now)
+        self.metrics.count(entity, 'rows_inserted', cursor.rowcount)
 
     def update(self):
-        query = self.config['ac']['query']
+        self.sync('update')
+        if self.config['db'].get('reconcile_deletes', False):
+            self.reconcile_deletes()
+
+    def ac_objectids(self, entity):
+        # every ObjectID in scope of ac.query in ascending order
+        return self.source.objectids(entity, self.config['ac']['query'])
+
+    def reconcile_deletes(self, batch=10000):
+        # close the current versions of items deleted in AC or moved out of scope of ac.query:
+        # the ObjectIDs from WSAPI and the open rows are both streamed in ObjectID order and
+        # anti-joined, and the missing ones are closed with _deleted = true, `batch` ids per UPDATE
         for entity in self.entities:
-            records_to_set_end = []
-            new_row_oids = []
-            second_cursor = self.db.cursor()
-            fields = [k for column in self.columns[entity] for k, v in column.items()]
-            fetch = ','.join(fields)
-            response = self.ac.get('%s' % entity, fetch=fetch, query=query, order="ObjectID", pagesize=200)
-            for item in response:
-                field_values = []
-                formatters = ""
-                empty_fields = []
-                for field in fields:
-                    value = getattr(item, field)
-                    # RATING   type e.g. Severity     when empty return 'None'.
-                    # QUANTITY type e.g. PlanEstimate when empty return None
-                    if not value or value == 'None':
-                        empty_fields.append(field)
+            with self.pool.connection() as db:
+                cursor = db.cursor()
+                cursor.execute("ALTER TABLE %s ADD COLUMN IF NOT EXISTS _deleted boolean default false", (AsIs(entity),))
+                oids = self.ac_objectids(entity)
+                first = next(oids, None)
+                if first is None:
+                    # an empty result is far more likely a bad query or scope than a deleted workspace
+                    log.warning("%s: no items in scope of the query, skipping the deletion check", entity,
+                                extra={'entity': entity})
+                    continue
+                open_rows = db.cursor(name='open_%s' % entity)
+                open_rows.itersize = batch
+                open_rows.execute("SELECT id, ObjectID FROM %s WHERE _end IS NULL ORDER BY ObjectID" % entity)
+                now = datetime.now(timezone.utc)
+                closed = 0
+                missing = (id for id, oid in anti_join(open_rows, itertools.chain([first], oids)))
+                for ids in batched(missing, batch):
+                    if self.layout() == 'split':
+                        cursor.execute(move_deleted_sql(entity, self.history_table(entity), self.codecs[entity]), (ids, now,))
                     else:
-                        formatters = formatters + "%s,"
-                        number_fields = [k for column in self.columns[entity] for k,v in column.items() if 'INTEGER' in column.values() or 'QUANTITY' in column.values()]
-                        if field not in number_fields and field != 'None':
-                            value = "'" + value + "'"
-                        field_values.append(value)
-                non_empty_fields = fields[:]
-                for field in empty_fields:
-                    non_empty_fields.remove(field)
-                columns = ','.join(non_empty_fields)
-                formatters = formatters[:-1]  # remove trailing comma
-                expression = "VALUES (%s)" % formatters % tuple(field_values)
-                for field in non_empty_fields:
-                    # there will be multiple rows with the same name if there are multiple snapshots of the same records
-                    # get current snapshots (_end IS NULL) for each items
-                    # fetch id and each field one execution of SELECT command at a time for each record
-                    self.cursor.execute("SELECT id, %s FROM %s WHERE _end IS NULL and ObjectID = '%s';",
-                                        (AsIs(field), AsIs(entity), AsIs(item.ObjectID),))
-                    # compare the value of the same field in the item from response with corresponding value in the db:
-                    for row in self.cursor:
-                        #print("comparing %s with %s" %(item[field], row[1]))
-                        if getattr(item, field) != row[1]:
-                            if getattr(item, 'ObjectID') in new_row_oids:
-                                continue
-                            new_row_oids.append(getattr(item, 'ObjectID'))
-                            #print ("DIFF! record id %s" %row[0])
-                            records_to_set_end.append(row[0])
-                            second_cursor.execute("INSERT INTO %s (%s) %s RETURNING id;",(AsIs(entity), AsIs(columns), AsIs(expression),))
-                            new_row_id = second_cursor.fetchone()[0]
-                            print ("LAST inserted ID: %s" %new_row_id)
-                            second_cursor.execute("UPDATE %s SET _start = %s WHERE id = %s",
-                                     (AsIs(entity), datetime.now(timezone.utc), AsIs(new_row_id),))
-                        continue
-            for id in records_to_set_end:
-                self.cursor.execute("UPDATE %s SET _end = %s WHERE id = %s", (AsIs(entity), datetime.now(timezone.utc), AsIs(id),))
-        self.db.commit()
-        self.db.close()
+                        cursor.execute("UPDATE %s SET _end = %s, _deleted = true WHERE id = ANY(%s)",
+                                       (AsIs(entity), now, ids,))
+                    closed += len(ids)
+                open_rows.close()
+                db.commit()
+                self.metrics.count(entity, 'items_deleted', closed)
+                self.metrics.count(entity, 'rows_closed', closed)
+                log.info("%s: closed %d deleted or out of scope items", entity, closed, extra={'entity': entity})
+
+    def sources(self, entity):
+        # the relations to read the versions of an entity from, with labels in place of lookup ids
+        return ['%s_decoded' % table if self.enum_storage() == 'lookup' else table for table in self.tables(entity)]
 
+    def as_of(self, entity, moment, fields=None, batch=10000):
+        """
+        Streams the versions of `entity` valid at `moment` (a datetime, or a string postgres reads
+        as timestamp with time zone) in ObjectID order: the state of the items at that time.
+        Yields tuples of `fields`, by default the tracked ones.
+        """
+        fields = ','.join(fields or self.codecs[entity].fields)
+        # ObjectID is selected under its own name to order by, whether or not it is one of the fields
+        query = ' UNION ALL '.join(["SELECT %s, ObjectID AS _order FROM %s WHERE _valid @> %%(moment)s::timestamptz"
+                                    % (fields, source) for source in self.sources(entity)])
+        with self.pool.connection() as db:
+            versions = db.cursor(name='as_of_%s' % entity)
+            versions.itersize = batch
+            versions.execute("SELECT %s FROM (%s) v ORDER BY _order" % (fields, query), {'moment': moment})
+            for version in versions:
+                yield version
+            versions.close()
+
+    def record(self):
+        # run.py config.yml record: the typedefs and the pages of every entity in scope of ac.query written to
+        # replay.directory as WSAPI JSON, to be synced offline with ac.source: replay (see ReplaySource)
+        if self.ac is None:
+            sys.stderr.write("record reads from AC, it needs ac.source: wsapi\n")
+            sys.exit(1)
+        directory = self.replay_directory()
+        compress = (self.config.get('replay') or {}).get('compress', False)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # typedefs of entities recorded before are kept
+        typedefs = {}
+        if os.path.exists(os.path.join(directory, META)):
+            with open(os.path.join(directory, META)) as meta:
+                typedefs = dict([(typedef.get('ElementName') or typedef.get('Name'), typedef)
+                                 for typedef in json.load(meta)['Results']])
+        for typedef in self.schema:
+            typedef = typedef if isinstance(typedef, TypeDef) else TypeDef.from_pyral(typedef)
+            typedefs[typedef.ElementName] = typedef.to_dict()
+        with open(os.path.join(directory, META), 'w') as meta:
+            json.dump({'TotalResultCount': len(typedefs), 'Results': [typedefs[name] for name in sorted(typedefs)]}, meta)
+        wsapi = self.source.wsapi or WsapiJson(self.ac)
+        for entity in self.entities:
+            for path in page_files(directory, entity):
+                os.remove(path)
+            count, pages = 0, wsapi.pages(entity, self.codecs[entity].fetch, self.config['ac']['query'],
+                                          "ObjectID", self.pagesize)
+            for index, page in enumerate(pages):
+                write_page(directory, entity, index, page, compress)
+                count += len(page)
+            log.info("%s: recorded %d items to %s", entity, count, directory, extra={'entity': entity})
+
+    def export(self):
+        # run.py config.yml export [--full]: each entity as Parquet files, see ParquetExport
+        exporter = ParquetExport.from_config(self.config.get('export') or {})
+        for entity in self.entities:
+            with self.pool.connection() as db:
+                count = exporter.export(db, entity, self.codecs[entity], self.sources(entity), self.full)
+                db.commit()
+                log.info("%s: exported %d rows to %s", entity, count, exporter.directory, extra={'entity': entity})
+
+    def lookback_source(self):
+        lookback = self.config.get('lookback') or {}
+        if lookback.get('fixtures'):
+            return SnapshotFileSource(lookback['fixtures'])
+        if self.ac is None:
+            sys.stderr.write("backfill with ac.source: replay needs recorded snapshots in lookback.fixtures\n")
+            sys.exit(1)
+        return LookbackSource(self.config['ac']['url'], self.ac.getWorkspace().oid, self.ac.getProject().oid,
+                              apikey=self.config['ac'].get('apikey'), user=self.config['ac'].get('user'),
+                              password=self.config['ac'].get('password'), pagesize=lookback.get('pagesize', 10000))
+
+    def backfill(self, batch=10000):
+        # replace the versions of each entity with its snapshot history from the Lookback API,
+        # each version written with its real _ValidFrom/_ValidTo interval, `batch` versions per COPY
+        source = self.lookback_source()
+        for entity in self.entities:
+            with self.pool.connection() as db:
+                cursor = db.cursor()
+                self.ensure_partitions(cursor, entity)
+                self.use_lookups(cursor, entity)
+                codec = self.codecs[entity]
+                history = self.history_table(entity)
+                cursor.execute("TRUNCATE %s", (AsIs(', '.join(self.tables(entity))),))
+                count = 0
+                # drop-down fields are requested hydrated, as the labels the codec stores
+                snapshots = source.pages(entity, codec.fetched, hydrated(codec))
+                for versions in batched(snapshot_versions(codec, snapshots), batch):
+                    pages = {entity: io.StringIO(), history: io.StringIO()}
+                    for row, digest, valid_from, valid_to in versions:
+                        # with the split layout current versions go to the entity table, closed ones to the history
+                        pages[history if valid_to else entity].write(codec.copy_line(
+                            row, digest, parse_date(valid_from), parse_date(valid_to) if valid_to else None))
+                    for table in self.tables(entity):
+                        pages[table].seek(0)
+                        cursor.copy_expert("COPY %s (%s,_fingerprint,_start,_end) FROM STDIN" % (table, codec.columns),
+                                           pages[table])
+                    count += len(versions)
+                db.commit()
+                self.metrics.count(entity, 'rows_inserted', count)
+                log.info("%s: backfilled %d versions", entity, count, extra={'entity': entity})
@@ -1,26 +1,122 @@
 import sys
-from dbconnector import DBConnector
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dbconnector import DBConnector, read_config, configured_entities
+from async_engine import AsyncEngine
+from metrics import Metrics, configure_logging
+
+log = logging.getLogger(__name__)
+
+ACTIONS = ('create', 'migrate', 'update', 'reconcile', 'backfill', 'detach', 'export', 'record')
+
+def parse_options(args):
+    # options following <config_file.yml> <action> on the command line
+    parser = argparse.ArgumentParser(prog='run.py <config_file.yml> <action>')
+    parser.add_argument('--engine', choices=('sync', 'async'), default='sync',
+                        help='async overlaps WSAPI page requests with database writes')
+    parser.add_argument('--full', action='store_true',
+                        help='ignore the sync watermarks and fetch everything matching ac.query '
+                             '(export: write all versions, not only the ones since the last export)')
+    parser.add_argument('--refresh-schema', action='store_true',
+                        help='fetch the typedefs from AC instead of the schema cache (ac.schema_cache)')
+    return parser.parse_args(args)
+
+def perform(dbconnector, action, options=None):
+    dbconnector.full = bool(options and options.full)
+    if options and options.refresh_schema:
+        dbconnector.refresh_schema()
+    if options and options.engine == 'async' and action in ('create', 'update'):
+        AsyncEngine(dbconnector, in_flight=dbconnector.max_pages).run(action)
+    elif action == 'create':
+        # tables that already exist are only migrated, their data is left to update
+        dbconnector.insert_init_data(dbconnector.create_tables_n_columns())
+    elif action == 'migrate':
+        dbconnector.create_tables_n_columns()
+    elif action == 'update':
+        dbconnector.update()
+    elif action == 'reconcile':
+        dbconnector.reconcile_deletes()
+    elif action == 'backfill':
+        dbconnector.backfill()
+    elif action == 'detach':
+        dbconnector.detach_partitions()
+    elif action == 'export':
+        dbconnector.export()
+    elif action == 'record':
+        dbconnector.record()
+
+def sync_entity(config, action, entity, options=None):
+    # runs in a worker process with its own AC session and DB connection,
+    # so each entity commits (or fails) independently of the others
+    started = time.time()
+    dbconnector = None
+    try:
+        dbconnector = DBConnector(config, entities=[entity])
+        perform(dbconnector, action, options)
+        return {'entity': entity, 'status': 'ok', 'seconds': time.time() - started,
+                'metrics': dbconnector.metrics.to_dict()}
+    except (Exception, SystemExit) as msg:
+        return {'entity': entity, 'status': 'failed', 'seconds': time.time() - started, 'error': str(msg),
+                'metrics': dbconnector.metrics.to_dict() if dbconnector else None}
+    finally:
+        if dbconnector:
+            dbconnector.close()
 
 class DBConnectorRunner():
     def __init__(self, config):
-        self.dbconnector = DBConnector(config)
-
-    # def create(self):
-    #     self.dbconnector.create_tables_n_columns()
-    #     self.dbconnector.insert_init_data()
+        self.config   = config
+        self.settings = read_config(config)
+        self.workers  = self.settings['db'].get('workers', 1)
+        configure_logging(self.settings.get('log'))
+        self.dbconnector = None
+        if self.workers <= 1:
+            self.dbconnector = DBConnector(config)
 
     def run(self, args):
         action = args[1]
+        if action not in ACTIONS:
+            log.error('invalid action %s', action)
+            return
+        options = parse_options(args[2:])
+        if self.dbconnector is None and action == 'record':
+            # recorded in one process: the typedefs of all entities go to the same meta.json
+            self.dbconnector = DBConnector(self.config)
+        if self.dbconnector is None:
+            return self.run_parallel(action, options)
         try:
-            if action   == 'create':
-                self.dbconnector.create_tables_n_columns()
-                self.dbconnector.insert_init_data()
-            elif action == 'update':
-                self.dbconnector.update()
-            else:
-                print('invalid action')
+            perform(self.dbconnector, action, options)
         except Exception as msg:
             sys.stderr.write('Oh noes!\n %s' % msg)
             sys.exit(1)
         finally:
-            self.dbconnector.db.close()
+            self.dbconnector.close()
+            self.write_metrics(self.dbconnector.metrics, action)
+
+    def write_metrics(self, metrics, action):
+        # at the end of every run, failed ones included: see the metrics section of the config file
+        metrics.finish(action)
+        metrics.write(self.settings.get('metrics'))
+
+    def run_parallel(self, action, options):
+        entities = configured_entities(read_config(self.config))
+        if not entities:
+            log.warning('%s: db.tables names no entities', action)
+            return
+        started = time.time()
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(entities))) as pool:
+            results = list(pool.map(sync_entity, [self.config] * len(entities), [action] * len(entities), entities,
+                                    [options] * len(entities)))
+        failed = [result for result in results if result['status'] != 'ok']
+        log.info('%s summary: %d entities, %d failed, %.1fs', action, len(results), len(failed), time.time() - started)
+        metrics = Metrics()
+        metrics.started = started
+        for result in results:
+            log.info('    %-30s %-6s %8.1fs %s', result['entity'], result['status'], result['seconds'],
+                     result.get('error', ''), extra={'entity': result['entity'], 'seconds': result['seconds']})
+            if result['metrics']:
+                metrics.merge(result['metrics'])
+        self.write_metrics(metrics, action)
+        if failed:
+            sys.exit(1)
@@ -0,0 +1,191 @@
+import time
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolError(psycopg2.Error):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+    Connections are checked with a trivial query when borrowed (health_check) and closed
+    instead of reused once they have been idle for longer than max_idle seconds.
+    """
+    def __init__(self, minconn=1, maxconn=4, health_check=True, max_idle=300, timeout=30, **connect_kwargs):
+        self.minconn        = minconn
+        self.maxconn        = max(minconn, maxconn)
+        self.health_check   = health_check
+        self.max_idle       = max_idle
+        self.timeout        = timeout
+        self.connect_kwargs = connect_kwargs
+        self.idle           = []     # [(connection, returned_at)], most recently returned last
+        self.used           = set()
+        self.opening        = 0      # connections being opened outside the lock
+        self.closed         = False
+        self.lock           = threading.Condition()
+        for _ in range(minconn):
+            self.idle.append((self.connect(), time.time()))
+
+    @classmethod
+    def from_config(cls, db_config, **overrides):
+        # the db section of the config file; pool settings live under db: pool:
+        settings = db_config.get('pool') or {}
+        kwargs = dict(database=db_config['name'], user=db_config['user'], password=db_config['password'],
+                      host=db_config['host'], port=db_config['port'])
+        kwargs.update(overrides)
+        return cls(minconn=settings.get('min', 1), maxconn=settings.get('max', 4),
+                   health_check=settings.get('health_check', True), max_idle=settings.get('max_idle', 300),
+                   timeout=settings.get('timeout', 30), **kwargs)
+
+    def connect(self):
+        return psycopg2.connect(**self.connect_kwargs)
+
+    def healthy(self, conn):
+        if conn.closed:
+            return False
+        if not self.health_check:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        # a connection is reserved under the lock; connecting and the health check happen outside
+        # it, so other borrowers and putconn do not wait for a network round trip
+        deadline = time.time() + self.timeout
+        while True:
+            conn, returned_at = self.reserve(deadline)
+            if conn is None:
+                return self.open()
+            if time.time() - returned_at <= self.max_idle and self.healthy(conn):
+                return conn
+            self.discard(conn)
+            with self.lock:
+                self.used.discard(conn)
+                self.lock.notify()
+
+    def reserve(self, deadline):
+        # (an idle connection, when it was returned), or (None, None) for a new connection to be opened
+        with self.lock:
+            while True:
+                if self.closed:
+                    raise PoolError("connection pool is closed")
+                if self.idle:
+                    conn, returned_at = self.idle.pop()
+                    self.used.add(conn)
+                    return conn, returned_at
+                if len(self.used) + self.opening < self.maxconn:
+                    self.opening += 1
+                    return None, None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolError("no connection available after %ss (max %s)" % (self.timeout, self.maxconn))
+                self.lock.wait(remaining)
+
+    def open(self):
+        # a new connection in a slot reserved by reserve()
+        conn = None
+        try:
+            conn = self.connect()
+        finally:
+            with self.lock:
+                self.opening -= 1
+                if conn is not None and not self.closed:
+                    self.used.add(conn)
+                self.lock.notify()
+        if self.closed:
+            self.discard(conn)
+            raise PoolError("connection pool is closed")
+        return conn
+
+    def putconn(self, conn, close=False):
+        # the rollback of an unfinished transaction and the closing of connections happen outside the lock
+        if not conn.closed and not close:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+        with self.lock:
+            self.used.discard(conn)
+            if conn.closed or close or self.closed:
+                expired = [conn]
+            else:
+                self.idle.append((conn, time.time()))
+                expired = self.recycle()
+            self.lock.notify()
+        for conn in expired:
+            self.discard(conn)
+
+    def recycle(self):
+        # the connections idle for longer than max_idle, keeping at least minconn open; called with the lock held
+        now = time.time()
+        keep, expired = [], []
+        for conn, returned_at in self.idle:
+            if now - returned_at > self.max_idle and len(keep) + len(self.used) >= self.minconn:
+                expired.append(conn)
+            else:
+                keep.append((conn, returned_at))
+        self.idle = keep
+        return expired
+
+    @contextmanager
+    def connection(self, autocommit=False):
+        conn = self.getconn()
+        broken = False
+        try:
+            if conn.autocommit != autocommit:
+                conn.autocommit = autocommit
+            yield conn
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        except BaseException:
+            if not conn.closed and not conn.autocommit:
+                conn.rollback()
+            raise
+        finally:
+            if not broken and not conn.closed and conn.autocommit:
+                conn.autocommit = False
+            self.putconn(conn, close=broken)
+
+    def closeall(self):
+        with self.lock:
+            self.closed = True
+            for conn, returned_at in self.idle:
+                self.discard(conn)
+            for conn in self.used:
+                self.discard(conn)
+            self.idle = []
+            self.used = set()
+            self.lock.notify_all()
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+def get_pool(db_config, **overrides):
+    # one shared pool per database per process, e.g. for the utils/ scripts
+    key = (db_config['host'], db_config['port'], db_config['user'], overrides.get('database', db_config['name']))
+    with pools_lock:
+        pool = pools.get(key)
+        if pool is None or pool.closed:
+            pool = pools[key] = ConnectionPool.from_config(db_config, **overrides)
+        return pool
@@ -0,0 +1,157 @@
+import os
+import shutil
+from datetime import datetime, timezone
+from schema_planner import Column, COLUMN_TYPES
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_STATE = 'ac2pg_export_state'
+
+
+def arrow_type(rally_type):
+    # the pyarrow type of the column an AC AttributeType is stored in (COLUMN_TYPES); STATE and RATING
+    # values are exported as their labels whatever db.enum_storage keeps in the table
+    column = 'text' if rally_type in ('STATE', 'RATING') else Column(rally_type, COLUMN_TYPES[rally_type]).data_type()
+    return {
+        'bigint'                  : pyarrow.int64(),
+        'timestamp with time zone': pyarrow.timestamp('us', tz='UTC'),
+        'boolean'                 : pyarrow.bool_(),
+        'double precision'        : pyarrow.float64(),
+        'text'                    : pyarrow.string(),
+    }[column]
+
+def arrow_schema(codec):
+    # the tracked fields of the entity followed by the validity of the version
+    fields = [pyarrow.field(field, arrow_type(type)) for field, type in zip(codec.fields, codec.types)]
+    fields += [pyarrow.field('_start', arrow_type('DATE')), pyarrow.field('_end', arrow_type('DATE')),
+               pyarrow.field('_deleted', arrow_type('BOOLEAN'))]
+    return pyarrow.schema(fields)
+
+
+class ParquetExport:
+    """
+    Writes entities as Parquet files for analytics: `current` exports the current version of every
+    item, `history` all versions. Each run writes a partition directory
+    <directory>/<entity>/exported_at=<time>/part-<n>.parquet, so the files read as one dataset
+    (e.g. pandas.read_parquet('<directory>/Defect')).
+
+    A current export replaces the snapshot of the previous run: the dataset holds one row per item.
+    A history export is incremental, unless `full` is set: it appends the versions started after
+    the last exported one, and again the versions exported while current that were closed since
+    (their _end set, by an update or as deleted). A version can then be in several partitions;
+    the one with the latest exported_at is its state as of the last export.
+    """
+    def __init__(self, directory, mode='current', rows_per_file=1000000, batch=10000):
+        if pyarrow is None:
+            raise ImportError("the export action needs pyarrow (pip install pyarrow)")
+        self.directory     = directory
+        self.mode          = mode
+        self.rows_per_file = rows_per_file
+        self.batch         = batch
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('directory', 'export'), config.get('mode', 'current'),
+                   config.get('rows_per_file', 1000000), config.get('batch', 10000))
+
+    def ensure_state(self, cursor):
+        cursor.execute("CREATE TABLE IF NOT EXISTS %s (entity text PRIMARY KEY, last_start timestamp with time zone, "
+                       "exported_at timestamp with time zone)" % EXPORT_STATE)
+        cursor.execute("ALTER TABLE %s ADD COLUMN IF NOT EXISTS last_end timestamp with time zone" % EXPORT_STATE)
+
+    def last_exported(self, cursor, entity):
+        # (greatest _start, greatest _end) of the versions exported so far
+        cursor.execute("SELECT last_start, last_end FROM " + EXPORT_STATE + " WHERE entity = %s", (entity,))
+        row = cursor.fetchone()
+        return tuple(row) if row else (None, None)
+
+    def save_last_exported(self, cursor, entity, last_start, last_end):
+        cursor.execute("INSERT INTO " + EXPORT_STATE + " (entity, last_start, last_end, exported_at) "
+                       "VALUES (%s, %s, %s, now()) ON CONFLICT (entity) DO UPDATE SET last_start = EXCLUDED.last_start, "
+                       "last_end = EXCLUDED.last_end, exported_at = EXCLUDED.exported_at",
+                       (entity, last_start, last_end,))
+
+    def query(self, codec, sources, since=None):
+        # `sources` are the tables (or decoded views) holding the versions of the entity
+        columns = '%s,_start,_end,_deleted' % codec.columns
+        conditions = ['_end IS NULL'] if self.mode == 'current' else []
+        if since is not None:
+            conditions.append('(_start > %(since)s OR _end > %(closed_since)s)')
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return ' UNION ALL '.join(['SELECT %s FROM %s%s' % (columns, source, where) for source in sources])
+
+    def replace_snapshots(self, entity, target):
+        # the partitions of the previous current exports, once the new one is in place
+        directory = os.path.join(self.directory, entity)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith('exported_at=') and path != target:
+                shutil.rmtree(path)
+
+    def export(self, connection, entity, codec, sources, full=False):
+        """
+        Streams the versions of `entity` through a server-side cursor into Parquet files and
+        returns the number of rows written. Runs in the transaction of `connection`, which the
+        caller commits to record the export watermark.
+        """
+        cursor = connection.cursor()
+        self.ensure_state(cursor)
+        since, closed_since = (None, None) if full or self.mode == 'current' else self.last_exported(cursor, entity)
+        # every version closed since the last export has an _end past all the _start and _end values it wrote
+        closed_since = latest([closed_since], since)
+        schema = arrow_schema(codec)
+        names = schema.names
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S.%fZ')
+        target = os.path.join(self.directory, entity, 'exported_at=%s' % stamp)
+        # written under a hidden name (skipped by parquet readers) and renamed once complete
+        partial = os.path.join(self.directory, entity, '.exported_at=%s' % stamp)
+        os.makedirs(partial)
+        rows = connection.cursor(name='export_%s' % entity)
+        rows.itersize = self.batch
+        rows.execute(self.query(codec, sources, since), {'since': since, 'closed_since': closed_since})
+        count, files, writer, in_file, last_start, last_end = 0, 0, None, 0, since, closed_since
+        try:
+            while True:
+                fetched = rows.fetchmany(self.batch)
+                if not fetched:
+                    break
+                if writer is None or in_file >= self.rows_per_file:
+                    if writer:
+                        writer.close()
+                    writer = pyarrow.parquet.ParquetWriter(os.path.join(partial, 'part-%05d.parquet' % files), schema)
+                    files += 1
+                    in_file = 0
+                columns = list(zip(*fetched))
+                writer.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)], names=names))
+                last_start = latest(columns[names.index('_start')], last_start)
+                last_end = latest(columns[names.index('_end')], last_end)
+                count += len(fetched)
+                in_file += len(fetched)
+            rows.close()
+        except BaseException:
+            if writer:
+                writer.close()
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        if writer:
+            writer.close()
+        if files:
+            os.rename(partial, target)
+        else:
+            os.rmdir(partial)
+        if self.mode == 'current':
+            self.replace_snapshots(entity, target)
+        elif last_start is not None:
+            self.save_last_exported(cursor, entity, last_start, last_end)
+        return count
+
+
+def latest(values, previous):
+    # the greatest of the timestamps `values` and `previous`, None when there are none
+    values = [value for value in values if value is not None] + ([previous] if previous is not None else [])
+    return max(values) if values else None
@@ -0,0 +1,95 @@
+import os
+import json
+import glob
+import requests
+
+FOREVER = '9999-01-01T00:00:00.000Z'   # _ValidTo of the current snapshot of an item
+
+
+def hydrated(codec):
+    # the drop-down fields of a codec: Lookback returns them as ObjectIDs of their allowed values unless hydrated
+    return [field for field, type in zip(codec.fields, codec.types) if type in ('STATE', 'RATING')]
+
+
+class LookbackSource:
+    """
+    Pages of snapshots of an entity from the AC Lookback API, sorted by ObjectID and _ValidFrom.
+    """
+    def __init__(self, server, workspace_oid, project_oid=None, apikey=None, user=None, password=None,
+                 pagesize=10000):
+        self.url      = 'https://%s/analytics/v2.0/service/rally/workspace/%s/artifact/snapshot/query.js' % \
+                        (server, workspace_oid)
+        self.project  = project_oid
+        self.pagesize = pagesize
+        self.session  = requests.Session()
+        if apikey:
+            self.session.headers['ZSESSIONID'] = apikey
+        else:
+            self.session.auth = (user, password)
+
+    def request(self, entity, fields, start, hydrate=()):
+        find = {'_TypeHierarchy': entity}
+        if self.project:
+            find['_ProjectHierarchy'] = int(self.project)
+        body = {
+            'find'     : find,
+            'fields'   : list(fields) + ['_ValidFrom', '_ValidTo'],
+            'hydrate'  : list(hydrate),
+            'sort'     : {'ObjectID': 1, '_ValidFrom': 1},
+            'start'    : start,
+            'pagesize' : self.pagesize,
+            'removeUnauthorizedSnapshots': True,
+        }
+        response = self.session.post(self.url, data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        response.raise_for_status()
+        return response.json()
+
+    def pages(self, entity, fields, hydrate=()):
+        # `hydrate`: the fields returned as their labels, see hydrated()
+        start = 0
+        while True:
+            page = self.request(entity, fields, start, hydrate)
+            results = page.get('Results', [])
+            if results:
+                yield results
+            start += len(results)
+            if not results or start >= int(page.get('TotalResultCount', 0)):
+                break
+
+
+class SnapshotFileSource:
+    """
+    Recorded Lookback API responses, one JSON file per page, e.g. Defect_snapshots_0.json,
+    Defect_snapshots_1.json ... in `directory`, read in page order. They are recorded hydrated.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def pages(self, entity, fields, hydrate=()):
+        names = glob.glob(os.path.join(self.directory, '%s_snapshots_*.json' % entity))
+        for name in sorted(names, key=lambda name: int(name.rsplit('_', 1)[1].split('.')[0])):
+            with open(name) as json_data:
+                yield json.load(json_data)['Results']
+
+
+def snapshot_versions(codec, pages):
+    """
+    Turns snapshot pages sorted by ObjectID and _ValidFrom into versions
+    (row, fingerprint, valid_from, valid_to), valid_to None for the current one.
+    Consecutive snapshots of an item that differ only in untracked fields are merged.
+    """
+    pending = None
+    for page in pages:
+        for snapshot in page:
+            row = codec.convert(tuple([snapshot.get(field) for field in codec.fetched]))
+            digest = codec.fingerprint(row)
+            valid_to = snapshot.get('_ValidTo')
+            valid_to = None if not valid_to or valid_to >= FOREVER else valid_to
+            if pending and pending[0][codec.oid] == row[codec.oid] and pending[1] == digest:
+                pending[3] = valid_to
+                continue
+            if pending:
+                yield tuple(pending)
+            pending = [row, digest, snapshot['_ValidFrom'], valid_to]
+    if pending:
+        yield tuple(pending)
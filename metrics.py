@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+PREFIX = 'ac2pg'
+
+# the counters kept per entity, with their Prometheus help
+COUNTERS = {
+    'pages_fetched' : 'Pages of items read from the source.',
+    'items_seen'    : 'Items read from the source.',
+    'items_changed' : 'Items whose tracked values changed since the last sync.',
+    'items_deleted' : 'Items closed by reconcile as deleted in AC or out of scope.',
+    'rows_inserted' : 'Versions written.',
+    'rows_closed'   : 'Versions closed.',
+    'bytes_received': 'Bytes of WSAPI JSON responses or recorded pages read (not counted for ac.backend: pyral).',
+}
+
+# the stages timed per entity
+STAGES = ('fetch', 'decode', 'encode', 'write', 'commit')
+
+
+class Metrics:
+    """
+    Counters (see COUNTERS) and stage timers (see STAGES) per entity for one run of an action,
+    exported at the end of the run as JSON and in the Prometheus text format (metrics: in the
+    config file). Safe to update from the fetch, shard and writer threads.
+    """
+    def __init__(self):
+        self.lock     = threading.Lock()
+        self.counters = {}    # {entity: {name: value}}
+        self.seconds  = {}    # {entity: {stage: seconds}}
+        self.action   = None
+        self.started  = time.time()
+        self.finished = None
+
+    def count(self, entity, name, value=1):
+        with self.lock:
+            counters = self.counters.setdefault(entity, {})
+            counters[name] = counters.get(name, 0) + value
+
+    def time(self, entity, stage, seconds):
+        with self.lock:
+            stages = self.seconds.setdefault(entity, {})
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, entity, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.time(entity, stage, time.perf_counter() - started)
+
+    def finish(self, action):
+        self.action   = action
+        self.finished = time.time()
+
+    def merge(self, metrics):
+        # the to_dict() of the metrics of another process (db.workers > 1)
+        for entity, values in metrics['entities'].items():
+            for name, value in values['counters'].items():
+                self.count(entity, name, value)
+            for stage, seconds in values['seconds'].items():
+                self.time(entity, stage, seconds)
+
+    def to_dict(self):
+        with self.lock:
+            entities = sorted(set(self.counters) | set(self.seconds))
+            return {
+                'action'      : self.action,
+                'started'     : datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                'wall_seconds': round((self.finished or time.time()) - self.started, 3),
+                'entities'    : dict([(entity, {'counters': dict(self.counters.get(entity, {})),
+                                                'seconds' : dict([(stage, round(seconds, 6)) for stage, seconds
+                                                                  in self.seconds.get(entity, {}).items()])})
+                                      for entity in entities]),
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        # the text exposition format, e.g. for the textfile collector of the node exporter
+        metrics = self.to_dict()
+        action = metrics['action'] or ''
+        lines = []
+
+        def family(name, type, help, samples):
+            lines.append('# HELP %s_%s %s' % (PREFIX, name, help))
+            lines.append('# TYPE %s_%s %s' % (PREFIX, name, type))
+            for labels, value in samples:
+                lines.append('%s_%s{%s} %s' % (PREFIX, name, ','.join(['%s="%s"' % (key, escape(label))
+                                                                      for key, label in labels]), value))
+
+        entities = metrics['entities']
+        names = sorted(set([name for values in entities.values() for name in values['counters']]))
+        for name in names:
+            family('%s_total' % name, 'counter', COUNTERS.get(name, name.replace('_', ' ') + '.'),
+                   [((('action', action), ('entity', entity)), values['counters'][name])
+                    for entity, values in sorted(entities.items()) if name in values['counters']])
+        family('stage_seconds_total', 'counter', 'Seconds spent per stage of the sync.',
+               [((('action', action), ('entity', entity), ('stage', stage)), values['seconds'][stage])
+                for entity, values in sorted(entities.items())
+                for stage in sorted(values['seconds'], key=stage_order)])
+        family('run_seconds', 'gauge', 'Wall time of the run.', [((('action', action),), metrics['wall_seconds'])])
+        family('run_finished_timestamp_seconds', 'gauge', 'When the run finished.',
+               [((('action', action),), round(self.finished or time.time(), 3))])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, config):
+        # the files of the metrics section of the config file: json and/or prometheus
+        config = config or {}
+        for key, render in (('json', self.to_json), ('prometheus', self.to_prometheus)):
+            if config.get(key):
+                # written aside and renamed, so a collector never reads a partial file
+                with open(config[key] + '.tmp', 'w') as out:
+                    out.write(render())
+                os.replace(config[key] + '.tmp', config[key])
+
+
+def escape(label):
+    return str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def stage_order(stage):
+    return (STAGES.index(stage), stage) if stage in STAGES else (len(STAGES), stage)
+
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per record (log.format: json), with the entity and other `extra` fields of the record
+    FIELDS = ('entity', 'action', 'stage', 'count', 'seconds')
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+                 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        for field in self.FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+def configure_logging(config):
+    # the log section of the config file: level (INFO) and format (text | json), to stderr
+    config = config or {}
+    handler = logging.StreamHandler()
+    if config.get('format', 'text') == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(getattr(logging, str(config.get('level', 'INFO')).upper()))
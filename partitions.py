@@ -0,0 +1,94 @@
+import re
+import logging
+from datetime import datetime, timezone
+
+# versions are partitioned on the start of their validity
+KEY = '_start'
+
+log = logging.getLogger(__name__)
+
+
+def partition_start(moment, months=1):
+    # first day of the `months` long range containing `moment`, ranges aligned to January
+    index = (moment.year * 12 + moment.month - 1) // months * months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+def add_months(moment, months):
+    index = moment.year * 12 + moment.month - 1 + months
+    return moment.replace(year=index // 12, month=index % 12 + 1)
+
+def partition_name(table, lower):
+    return ('%s_p%04d_%02d' % (table, lower.year, lower.month)).lower()
+
+def partition_lower(table, name):
+    # the lower bound of a partition created by plan_partitions, None for other tables (e.g. the default one)
+    match = re.match(r'%s_p(\d{4})_(\d{2})$' % re.escape(table.lower()), name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc) if match else None
+
+def plan_partitions(table, months, since, until):
+    """
+    CREATE TABLE IF NOT EXISTS statements for the partitions of `table` covering since .. until,
+    plus its default partition, which receives versions older than the first partition.
+    """
+    statements = ['CREATE TABLE IF NOT EXISTS %s_default PARTITION OF %s DEFAULT' % (table.lower(), table)]
+    lower = partition_start(since, months)
+    while lower <= until:
+        upper = add_months(lower, months)
+        statements.append("CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM ('%s') TO ('%s')" %
+                          (partition_name(table, lower), table, lower.isoformat(' '), upper.isoformat(' ')))
+        lower = upper
+    return statements
+
+
+class Partitions:
+    """
+    Monthly (or `months` long) range partitions of entity tables on _start, see db.partition.
+    Partitions for the current range and the next `ahead` ranges are created before every sync,
+    so writes never wait for DDL; `keep` is how many months of partitions detach() leaves attached.
+    """
+    def __init__(self, months=1, ahead=3, keep=24):
+        self.months = months
+        self.ahead  = ahead
+        self.keep   = keep
+
+    @classmethod
+    def from_config(cls, db_config):
+        partition = db_config.get('partition')
+        if not partition:
+            return None
+        return cls(partition.get('months', 1), partition.get('ahead', 3), partition.get('keep', 24))
+
+    def is_partitioned(self, cursor, table):
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", (table,))
+        return cursor.fetchone()[0]
+
+    def ensure(self, cursor, table, now=None):
+        now = now or datetime.now(timezone.utc)
+        for statement in plan_partitions(table, self.months, now, add_months(now, self.months * self.ahead)):
+            cursor.execute(statement)
+
+    def attached(self, cursor, table):
+        cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                       "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname", (table,))
+        return [name for name, in cursor.fetchall()]
+
+    def detach(self, cursor, table, now=None):
+        """
+        Detaches the partitions of `table` that ended more than `keep` months ago. A detached
+        partition stays in the database as a plain table (e.g. defect_p2016_01) to be dumped
+        and dropped. Partitions still holding current versions (_end IS NULL) are kept.
+        Returns the names of the detached partitions.
+        """
+        cutoff = add_months(partition_start(now or datetime.now(timezone.utc)), -self.keep)
+        detached = []
+        for name in self.attached(cursor, table):
+            lower = partition_lower(table, name)
+            if lower is None or add_months(lower, self.months) > cutoff:
+                continue
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM %s WHERE _end IS NULL)" % name)
+            if cursor.fetchone()[0]:
+                log.warning("%s: %s still has current versions, not detached", table, name)
+                continue
+            cursor.execute("ALTER TABLE %s DETACH PARTITION %s" % (table, name))
+            detached.append(name)
+        return detached
@@ -0,0 +1,142 @@
+import sys
+import time
+import logging
+import threading
+from queue import Queue, Full
+
+DONE = object()
+
+log = logging.getLogger(__name__)
+
+
+def put(queue, item, cancelled):
+    # a full queue blocks the producer until the consumer takes an item; give up once the consumer
+    # went away and set `cancelled`. Used by the shard threads of ShardedFetch too
+    while not cancelled.is_set():
+        try:
+            queue.put(item, timeout=0.5)
+            return True
+        except Full:
+            continue
+    return False
+
+
+class StageStats:
+    __slots__ = ('name', 'items', 'seconds')
+
+    def __init__(self, name):
+        self.name    = name
+        self.items   = 0
+        self.seconds = 0.0
+
+    def rate(self):
+        return self.items / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return "%-8s %8d items %9.3fs %10.1f items/s" % (self.name, self.items, self.seconds, self.rate())
+
+
+class Pipeline:
+    """
+    Streams one entity from AC to postgres as  page fetch -> decode -> encode -> batch write.
+    The fetch and decode stages run on their own thread: each page of pyral items is decoded
+    into tuples as soon as it is complete and the items are dropped, so at most one page of
+    pyral objects is alive, and at most max_pages pages of tuples are held between the AC
+    response and the writer. Memory does not grow with the size of the entity.
+    """
+    def __init__(self, entity, codec, pagesize=200, max_pages=4):
+        self.entity    = entity
+        self.codec     = codec
+        self.pagesize  = pagesize
+        self.max_pages = max(1, max_pages)
+        self.stats     = [StageStats(name) for name in ('fetch', 'decode', 'encode', 'write')]
+        self.pages     = 0
+
+    def decode(self, page, started, observe=None, decoded=False):
+        # one page of AC items in their compact form; `started` is when fetching the page began.
+        # The pyral items are dropped before the page is queued, a `decoded` page is kept as is
+        fetched = time.perf_counter()
+        self.pages += 1
+        self.stats[0].seconds += fetched - started
+        self.stats[0].items += len(page)
+        raws = page
+        if not decoded:
+            decode = self.codec.decode
+            raws = [decode(item) for item in page]
+            del page[:]
+        if observe:
+            observe(self.codec, raws)
+        self.stats[1].seconds += time.perf_counter() - fetched
+        self.stats[1].items += len(raws)
+        return raws
+
+    def fetch(self, response, observe=None, decoded=False):
+        # pages of decoded items; a `decoded` response (ShardedFetch with decode) yields them already
+        pages = Queue(maxsize=self.max_pages)
+        cancelled = threading.Event()
+
+        def produce():
+            items = None
+            try:
+                items = iter(response)
+                page = []
+                started = time.perf_counter()
+                for item in items:
+                    page.append(item)
+                    if len(page) == self.pagesize:
+                        if not put(pages, self.decode(page, started, observe, decoded), cancelled):
+                            return
+                        page = []
+                        started = time.perf_counter()
+                if page and not put(pages, self.decode(page, started, observe, decoded), cancelled):
+                    return
+                put(pages, DONE, cancelled)
+            except BaseException:
+                put(pages, sys.exc_info(), cancelled)
+            finally:
+                # a generator response (WsapiJson.get, ShardedFetch) releases its request or shard threads
+                close = getattr(items, 'close', None)
+                if close:
+                    close()
+
+        producer = threading.Thread(target=produce, name='fetch-%s' % self.entity, daemon=True)
+        producer.start()
+        try:
+            while True:
+                page = pages.get()
+                if page is DONE:
+                    break
+                if isinstance(page, tuple):
+                    raise page[1].with_traceback(page[2])
+                yield page
+        finally:
+            # the writer or the consumer failed, or is done: the producer stops at its next page
+            cancelled.set()
+            producer.join()
+
+    def encode(self, pages):
+        stats, convert = self.stats[2], self.codec.convert
+        for raws in pages:
+            started = time.perf_counter()
+            rows = [convert(raw) for raw in raws]
+            stats.seconds += time.perf_counter() - started
+            stats.items += len(rows)
+            yield rows
+
+    def run(self, response, write, observe=None, decoded=False):
+        stats = self.stats[3]
+        pages = self.fetch(response, observe, decoded)
+        try:
+            for rows in self.encode(pages):
+                started = time.perf_counter()
+                write(rows)
+                stats.seconds += time.perf_counter() - started
+                stats.items += len(rows)
+        finally:
+            pages.close()
+        return stats.items
+
+    def report(self):
+        for stage in self.stats:
+            log.info("%s %s", self.entity, stage,
+                     extra={'entity': self.entity, 'stage': stage.name, 'count': stage.items, 'seconds': stage.seconds})
@@ -0,0 +1,155 @@
+import hashlib
+import operator
+from datetime import datetime, timezone
+
+
+def parse_date(value):
+    # AC dates come back as ISO 8601 strings in UTC, e.g. '2016-01-13T15:05:26.890Z'
+    if isinstance(value, datetime):
+        return value
+    value = value.rstrip('Z')
+    fmt = "%Y-%m-%dT%H:%M:%S.%f" if '.' in value else "%Y-%m-%dT%H:%M:%S"
+    return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+
+def to_text(value):
+    return value if isinstance(value, str) else str(value)
+
+CONVERTERS = {
+    'INTEGER' : int,
+    'QUANTITY': float,
+    'DATE'    : parse_date,
+    'BOOLEAN' : bool,
+    'STRING'  : to_text,
+    'TEXT'    : to_text,
+    'STATE'   : to_text,
+    'RATING'  : to_text,
+}
+
+# value written for an empty field; BOOLEAN columns are created with 'default false'
+EMPTY = {
+    'BOOLEAN': False,
+}
+
+
+def copy_escape(value):
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, datetime):
+        # a space rather than 'T': time with time zone columns only accept the space separated form
+        return value.isoformat(' ')
+    if isinstance(value, (bytes, memoryview)):
+        return '\\\\x' + bytes(value).hex()
+    value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def canonical(value):
+    # one text form per value, whether it was converted from AC or read back from postgres
+    if value is None:
+        return '\x00'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).isoformat()
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def fingerprint(row):
+    return hashlib.md5('\x1f'.join([canonical(value) for value in row]).encode('utf-8')).digest()
+
+
+class RowCodec:
+    """
+    Compiled per-entity row layout built by DBConnector.cache_columns.
+    Turns an AC item into a tuple of query parameters in column order in one pass.
+    Every version row also stores the md5 fingerprint of its tracked values in _fingerprint;
+    `columns` is recorded with the fingerprints so they can be recomputed when ac.fetch changes.
+    `encodings` maps fields stored as lookup ids ({'ScheduleState': {'Defined': 1, ...}}); rows and
+    their fingerprints keep the labels, the ids are only substituted when a row is written.
+    """
+    __slots__ = ('entity', 'fields', 'types', 'converters', 'empties', 'columns', 'insert_sql', 'oid',
+                 'fetched', 'fetch', 'lud', 'encoders', 'getter', 'item_getter')
+
+    def __init__(self, entity, columns, encodings=None):
+        # columns is the cache_columns form: [{'CreationDate': 'DATE'}, {'ObjectID': 'INTEGER'}, ...]
+        pairs = [(k, v) for column in columns for k, v in column.items()]
+        set_ = object.__setattr__
+        set_(self, 'entity',     entity)
+        set_(self, 'fields',     tuple(k for k, v in pairs))
+        set_(self, 'types',      tuple(v for k, v in pairs))
+        set_(self, 'converters', tuple(CONVERTERS.get(v, to_text) for k, v in pairs))
+        set_(self, 'empties',    tuple(EMPTY.get(v) for k, v in pairs))
+        set_(self, 'columns',    ','.join(self.fields))
+        set_(self, 'insert_sql', "INSERT INTO %s (%s,_fingerprint) VALUES (%s)" %
+                                 (entity, self.columns, ','.join(['%s'] * (len(pairs) + 1))))
+        set_(self, 'oid',        self.fields.index('ObjectID') if 'ObjectID' in self.fields else None)
+        # LastUpdateDate is always fetched for the sync watermark; when it is not a tracked
+        # column it trails the tracked values in the decoded tuple and convert() drops it
+        fetched = self.fields if 'LastUpdateDate' in self.fields else self.fields + ('LastUpdateDate',)
+        set_(self, 'fetched',    fetched)
+        set_(self, 'fetch',      ','.join(fetched))
+        set_(self, 'lud',        fetched.index('LastUpdateDate'))
+        # one C level call reading all fetched attributes of an item (fetched has at least two fields)
+        set_(self, 'getter',     operator.attrgetter(*fetched) if len(fetched) > 1 else None)
+        set_(self, 'item_getter', operator.itemgetter(*fetched) if len(fetched) > 1 else None)
+        set_(self, 'encoders',   tuple(encodings.get(k) for k, v in pairs) if encodings else None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RowCodec is immutable")
+
+    def decode(self, item):
+        # the compact form of an AC item: a tuple of its fetched values, the item itself is not kept
+        if self.getter is not None:
+            try:
+                return self.getter(item)
+            except AttributeError:
+                pass
+        return tuple([getattr(item, field, None) for field in self.fetched])
+
+    def decode_json(self, result):
+        # the same compact form of an item of a WSAPI JSON response (a dict, see WsapiJson)
+        if self.item_getter is not None:
+            try:
+                return self.item_getter(result)
+            except KeyError:
+                pass
+        return tuple([result.get(field) for field in self.fetched])
+
+    def convert(self, raw):
+        row = []
+        append = row.append
+        for value, convert, empty in zip(raw, self.converters, self.empties):
+            # RATING   type e.g. Severity     when empty return 'None'.
+            # QUANTITY type e.g. PlanEstimate when empty return None
+            append(empty if (not value or value == 'None') else convert(value))
+        return tuple(row)
+
+    def encode(self, item):
+        return self.convert(self.decode(item))
+
+    def fingerprint(self, row):
+        return fingerprint(row)
+
+    def store(self, row):
+        # the row as written: labels of lookup fields replaced by their ids
+        if self.encoders is None:
+            return row
+        try:
+            return tuple([ids[value] if ids is not None and value is not None else value
+                          for value, ids in zip(row, self.encoders)])
+        except KeyError as ex:
+            raise ValueError("%s: %r is not a known value of a lookup column, "
+                             "run migrate --refresh-schema" % (self.entity, ex.args[0]))
+
+    def params(self, row):
+        # the insert_sql parameters of an encoded row
+        return self.store(row) + (fingerprint(row),)
+
+    def copy_line(self, row, *extra):
+        return '\t'.join([copy_escape(value) for value in self.store(row) + extra]) + '\n'
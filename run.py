@@ -5,7 +5,9 @@
 # dbconn  -- populates postgres db with AC data
 #
 USAGE = """
-Usage: python run.py <config_file.yml>
+Usage: python run.py <config_file.yml> <action> [--engine sync|async] [--full] [--refresh-schema]
+
+       where action is one of: create, migrate, update, reconcile, backfill, detach, export, record
 
        where the config file named must have content in YAML format with x sections;
          one for the Agile Central,
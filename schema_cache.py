@@ -0,0 +1,114 @@
+import os
+import json
+import time
+
+
+class AllowedValue:
+    __slots__ = ('StringValue',)
+
+    def __init__(self, StringValue):
+        self.StringValue = StringValue
+
+
+class Attribute:
+    __slots__ = ('ElementName', 'AttributeType', 'Custom', 'Constrained', 'ReadOnly', 'AllowedValues')
+
+    def __init__(self, ElementName, AttributeType, Custom=False, Constrained=False, ReadOnly=False, AllowedValues=()):
+        self.ElementName   = ElementName
+        self.AttributeType = AttributeType
+        self.Custom        = Custom
+        self.Constrained   = Constrained
+        self.ReadOnly      = ReadOnly
+        self.AllowedValues = [AllowedValue(value) for value in AllowedValues]
+
+    def to_dict(self):
+        return {'ElementName': self.ElementName, 'AttributeType': self.AttributeType, 'Custom': self.Custom,
+                'Constrained': self.Constrained, 'ReadOnly': self.ReadOnly,
+                'AllowedValues': [value.StringValue for value in self.AllowedValues]}
+
+
+class TypeDef:
+    """
+    The parts of a pyral typedef the connector uses, in a form that can be stored as JSON.
+    Attribute and property names follow pyral's, so it is a drop-in for ac.typedef(entity).
+    """
+    __slots__ = ('ElementName', 'LastUpdateDate', 'Attributes')
+
+    def __init__(self, ElementName, Attributes, LastUpdateDate=None):
+        self.ElementName    = ElementName
+        self.LastUpdateDate = LastUpdateDate
+        self.Attributes     = Attributes
+
+    @classmethod
+    def from_pyral(cls, typedef):
+        attributes = []
+        for attr in typedef.Attributes:
+            constrained = bool(getattr(attr, 'Constrained', False))
+            # allowed values are a separate request per attribute: only the constrained ones are kept
+            allowed = [value.StringValue for value in attr.AllowedValues] if constrained or \
+                      attr.AttributeType in ('STATE', 'RATING') else []
+            attributes.append(Attribute(attr.ElementName, attr.AttributeType, bool(getattr(attr, 'Custom', False)),
+                                        constrained, bool(getattr(attr, 'ReadOnly', False)), allowed))
+        return cls(typedef.ElementName, attributes, getattr(typedef, 'LastUpdateDate', None))
+
+    @classmethod
+    def from_dict(cls, typedef):
+        # also reads the playground meta.json form, which has Name instead of ElementName
+        attributes = [Attribute(attr['ElementName'], attr['AttributeType'], attr.get('Custom', False),
+                                attr.get('Constrained', False), attr.get('ReadOnly', False),
+                                attr.get('AllowedValues', ())) for attr in typedef['Attributes']]
+        return cls(typedef.get('ElementName') or typedef['Name'], attributes, typedef.get('LastUpdateDate'))
+
+    def to_dict(self):
+        return {'ElementName': self.ElementName, 'LastUpdateDate': self.LastUpdateDate,
+                'Attributes': [attr.to_dict() for attr in self.Attributes]}
+
+
+class TypedefCache:
+    """
+    Typedefs stored as JSON files in <directory>/<workspace>/<entity>.json.
+    A cached typedef younger than `ttl` seconds is used without any WSAPI request; an older
+    one costs a single request comparing the typedef's LastUpdateDate, and is only fetched
+    again in full when that changed.
+    """
+    def __init__(self, directory, workspace, ttl=86400):
+        self.directory = os.path.join(os.path.expanduser(directory), workspace.replace(os.sep, '_'))
+        self.ttl       = ttl
+
+    def path(self, entity):
+        return os.path.join(self.directory, '%s.json' % entity)
+
+    def load(self, entity):
+        try:
+            with open(self.path(entity)) as cached:
+                return json.load(cached)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def store(self, entity, typedef):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        temp = self.path(entity) + '.tmp'
+        with open(temp, 'w') as cached:
+            json.dump({'cached_at': time.time(), 'typedef': typedef.to_dict()}, cached)
+        os.replace(temp, self.path(entity))
+
+    def last_update_date(self, ac, entity):
+        response = ac.get('TypeDefinition', fetch='ElementName,LastUpdateDate', query='ElementName = %s' % entity,
+                          pagesize=1, limit=1)
+        for typedef in response:
+            return typedef.LastUpdateDate
+        return None
+
+    def get(self, ac, entity, refresh=False):
+        cached = None if refresh else self.load(entity)
+        if cached:
+            typedef = TypeDef.from_dict(cached['typedef'])
+            if time.time() - cached['cached_at'] < self.ttl:
+                return typedef
+            if typedef.LastUpdateDate and typedef.LastUpdateDate == self.last_update_date(ac, entity):
+                self.store(entity, typedef)
+                return typedef
+        typedef = TypeDef.from_pyral(ac.typedef(entity))
+        self.store(entity, typedef)
+        return typedef
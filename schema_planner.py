@@ -0,0 +1,231 @@
+import re
+
+# validity period of a version, maintained by postgres from _start and _end for every write path;
+# least() keeps it valid for versions whose _end precedes _start (migrated from time with time zone)
+VALID = ('_valid', 'tstzrange GENERATED ALWAYS AS (tstzrange(least(_start, _end), _end)) STORED')
+
+# the column type of each AC AttributeType; STATE and RATING columns are typed by db.enum_storage
+COLUMN_TYPES = {
+    'INTEGER' : 'bigint',
+    'DATE'    : 'timestamp with time zone',
+    'BOOLEAN' : 'boolean default false',
+    'QUANTITY': 'double precision',  # e.g. Rally PlanEstimate's AttributeType: "QUANTITY"
+    'STRING'  : 'text'
+}
+
+# columns every entity table has besides the AC attributes
+SYSTEM_COLUMNS = [
+    ('ID',           'SERIAL PRIMARY KEY'),
+    ('_start',       'timestamp with time zone'),
+    ('_end',         'timestamp with time zone'),
+    ('_fingerprint', 'bytea'),
+    ('_deleted',     'boolean default false'),
+    VALID,
+]
+
+# the same for a table partitioned on _start, whose primary key has to include it
+PARTITIONED_SYSTEM_COLUMNS = [
+    ('ID',           'SERIAL'),
+    ('_start',       'timestamp with time zone NOT NULL default now()'),
+    ('_end',         'timestamp with time zone'),
+    ('_fingerprint', 'bytea'),
+    ('_deleted',     'boolean default false'),
+    VALID,
+]
+
+# types a column can be altered to in place without losing values
+WIDENS = {
+    'smallint':         ('integer', 'bigint', 'double precision', 'text'),
+    'integer':          ('bigint', 'double precision', 'text'),
+    'bigint':           ('double precision', 'text'),
+    'real':             ('double precision', 'text'),
+    'double precision': ('text',),
+    'time with time zone': ('timestamp with time zone',),
+}
+
+# USING expressions of the type changes that need one; _start and _end were created as time with time zone
+# before tables were partitioned on them, their dates are lost and the date of the migration is assumed
+USING = {
+    ('time with time zone', 'timestamp with time zone'): 'current_date + %s',
+}
+
+
+class Column:
+    __slots__ = ('name', 'type', 'allowed', 'storage', 'entity')
+
+    def __init__(self, name, type, allowed=None, storage='check', entity=None):
+        self.name    = name
+        self.type    = type      # as declared, e.g. 'boolean default false'
+        self.allowed = allowed   # allowed values, None for a column that takes any value of its type
+        self.storage = storage   # how allowed values are enforced: check | enum | lookup (see db.enum_storage)
+        # the entity its enum type or lookup table is named after, shared by all tables of the entity
+        # (<entity> and <entity>_history); the table itself when not given
+        self.entity  = entity
+
+    def data_type(self):
+        # the declared type as information_schema.columns.data_type (udt_name for enums) reports it
+        return re.split(r' (?:default|not null|primary key|generated)\b', self.type.lower())[0]
+
+    def enum(self, table):
+        return enum_name(self.entity or table, self.name)
+
+    def lookup(self, table):
+        return lookup_name(self.entity or table, self.name)
+
+    def definition(self, table):
+        if self.allowed is not None and self.storage == 'lookup':
+            return '%s %s REFERENCES %s (id)' % (self.name, self.type, self.lookup(table))
+        return '%s %s' % (self.name, self.type)
+
+
+def quote(value):
+    return "'%s'" % value.replace("'", "''")
+
+def enum_name(table, column):
+    return ('%s_%s' % (table, column)).lower()
+
+def lookup_name(table, column):
+    return ('%s_%s_values' % (table, column)).lower()
+
+def check_name(table, column):
+    # the name postgres gives an unnamed column CHECK, so tables created before the planner match
+    return ('%s_%s_check' % (table, column)).lower()
+
+def check_values(definition):
+    # values of pg_get_constraintdef's rendering of IN (...): ((x = ANY (ARRAY['a'::text, 'b'::text])))
+    return [value.replace("''", "'") for value in re.findall(r"'((?:[^']|'')*)'::text", definition)]
+
+def check_clause(table, column):
+    return 'CONSTRAINT %s CHECK (%s IN (%s))' % (check_name(table, column.name), column.name,
+                                                  ','.join(quote(value) for value in column.allowed))
+
+def plan_enum(name, values, labels=None):
+    # an enum type with `values`, or the values missing from its existing `labels` (appended, they cannot be removed)
+    if labels is None:
+        return ['CREATE TYPE %s AS ENUM (%s)' % (name, ','.join(quote(value) for value in values))]
+    return ['ALTER TYPE %s ADD VALUE IF NOT EXISTS %s' % (name, quote(value)) for value in values if value not in labels]
+
+def plan_lookup(name, values, stored=None):
+    # a lookup table numbering `values` from 1, or the values missing from its `stored` {value: id}
+    statements = []
+    if stored is None:
+        statements.append('CREATE TABLE %s (id smallint PRIMARY KEY, value text UNIQUE NOT NULL)' % name)
+        stored = {}
+    missing = [value for value in values if value not in stored]
+    if missing:
+        first = max(stored.values() or [0]) + 1
+        statements.append('INSERT INTO %s (id, value) VALUES %s' %
+                          (name, ', '.join('(%d, %s)' % (first + i, quote(value)) for i, value in enumerate(missing))))
+    return statements
+
+def plan_view(table, columns):
+    # <table>_decoded: the table with the labels of its lookup columns in place of their ids
+    selected, joins = [], []
+    for column in columns:
+        if column.allowed is not None and column.storage == 'lookup':
+            alias = '_%s' % column.name.lower()
+            selected.append('%s.value AS %s' % (alias, column.name))
+            joins.append(' LEFT JOIN %s %s ON %s.id = t.%s' % (column.lookup(table), alias, alias, column.name))
+        else:
+            selected.append('t.%s' % column.name)
+    view = ('%s_decoded' % table).lower()
+    return ['DROP VIEW IF EXISTS %s' % view,
+            'CREATE VIEW %s AS SELECT %s FROM %s t%s' % (view, ', '.join(selected), table, ''.join(joins))]
+
+def plan_table(table, columns, existing=None, checks=None, partition_key=None, unique=None):
+    """
+    DDL that brings `table` to `columns`: a single CREATE TABLE when it does not exist
+    (`existing` is None), otherwise one ALTER TABLE adding missing columns, widening types and
+    replacing CHECK constraints whose allowed values changed. Columns are never dropped or
+    narrowed. `existing` maps lowercase column names to data types, `checks` constraint names
+    to their allowed values. A new table is range partitioned on `partition_key` when given,
+    and has a unique constraint on the `unique` column.
+    """
+    if existing is None:
+        definitions = [column.definition(table) for column in columns]
+        definitions += [check_clause(table, column) for column in columns
+                        if column.allowed is not None and column.storage == 'check']
+        if partition_key:
+            definitions.append('PRIMARY KEY (ID, %s)' % partition_key)
+        if unique:
+            definitions.append('UNIQUE (%s)' % unique)
+        partitioning = ' PARTITION BY RANGE (%s)' % partition_key if partition_key else ''
+        return ['CREATE TABLE %s (%s)%s' % (table, ', '.join(definitions), partitioning)]
+    checks = checks or {}
+    actions = []
+    for column in columns:
+        current = existing.get(column.name.lower())
+        if current is None:
+            actions.append('ADD COLUMN %s' % column.definition(table))
+        elif current != column.data_type() and column.data_type() in WIDENS.get(current, ('text',)):
+            using = USING.get((current, column.data_type()))
+            actions.append('ALTER COLUMN %s TYPE %s' % (column.name, column.data_type()) +
+                           (' USING %s' % (using % column.name) if using else ''))
+        if column.allowed is None or column.storage != 'check':
+            continue
+        name = check_name(table, column.name)
+        if name not in checks:
+            actions.append('ADD %s NOT VALID' % check_clause(table, column))
+        elif checks[name] != list(column.allowed):
+            # NOT VALID: history keeps values that were allowed when they were written
+            actions.append('DROP CONSTRAINT %s' % name)
+            actions.append('ADD %s NOT VALID' % check_clause(table, column))
+    return ['ALTER TABLE %s %s' % (table, ', '.join(actions))] if actions else []
+
+
+class SchemaPlanner:
+    """
+    Compares the wanted columns of entity tables with information_schema and the catalogs.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def existing(self, table):
+        self.cursor.execute("SELECT column_name, CASE WHEN data_type = 'USER-DEFINED' THEN udt_name ELSE data_type END "
+                            "FROM information_schema.columns "
+                            "WHERE table_schema = current_schema() AND table_name = lower(%s)", (table,))
+        columns = dict(self.cursor.fetchall())
+        return columns or None
+
+    def checks(self, table):
+        self.cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                            "WHERE conrelid = to_regclass(%s) AND contype = 'c'", (table,))
+        return {name: check_values(definition) for name, definition in self.cursor.fetchall()}
+
+    def enum_labels(self, name):
+        self.cursor.execute("SELECT to_regtype(%s) IS NOT NULL", (name,))
+        if not self.cursor.fetchone()[0]:
+            return None
+        self.cursor.execute("SELECT enumlabel FROM pg_enum WHERE enumtypid = to_regtype(%s) ORDER BY enumsortorder",
+                            (name,))
+        return [label for label, in self.cursor.fetchall()]
+
+    def lookup_values(self, name):
+        self.cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+        if not self.cursor.fetchone()[0]:
+            return None
+        self.cursor.execute("SELECT value, id FROM %s" % name)
+        return dict(self.cursor.fetchall())
+
+    def plan(self, table, columns, partition_key=None, unique=None):
+        """
+        Returns (statements, created): the DDL for `table` preceded by the enum types and lookup
+        tables its columns need (unless they exist, e.g. for another table of the entity), and
+        whether the table itself is created.
+        """
+        statements = []
+        for column in columns:
+            if column.allowed is None:
+                continue
+            if column.storage == 'enum':
+                name = column.enum(table)
+                statements += plan_enum(name, column.allowed, self.enum_labels(name))
+            elif column.storage == 'lookup':
+                name = column.lookup(table)
+                statements += plan_lookup(name, column.allowed, self.lookup_values(name))
+        existing = self.existing(table)
+        statements += plan_table(table, columns, existing, self.checks(table) if existing else None,
+                                 partition_key, unique)
+        if any(column.allowed is not None and column.storage == 'lookup' for column in columns):
+            statements += plan_view(table, columns)
+        return statements, existing is None
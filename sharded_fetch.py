@@ -0,0 +1,106 @@
+import sys
+import threading
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import DONE, put
+
+
+class Failure:
+    # an exception raised in a shard thread, re-raised by the consumer
+    __slots__ = ('exc_info',)
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def shard_ranges(low, high, shards):
+    # split the inclusive ObjectID range [low, high] into at most `shards` disjoint
+    # half-open ranges [lo, hi) in ascending order
+    span = high - low + 1
+    shards = max(1, min(shards, span))
+    step = span // shards
+    bounds = [low + i * step for i in range(shards)] + [high + 1]
+    return [(bounds[i], bounds[i + 1]) for i in range(shards)]
+
+def shard_query(query, low, high):
+    # pyral ANDs the conditions of a query given as a list
+    conditions = []
+    if isinstance(query, (list, tuple)):
+        conditions.extend(query)
+    elif query:
+        conditions.append(query)
+    conditions.append('ObjectID >= %s' % low)
+    conditions.append('ObjectID < %s' % high)
+    return conditions
+
+
+class ShardedFetch:
+    """
+    Iterates the items of an entity like a single ac.get(..., order="ObjectID") response
+    but splits the query into ObjectID ranges fetched concurrently on a thread pool.
+    Shards are drained in ObjectID order, so the merged stream stays ordered by ObjectID.
+    With `decode` (RowCodec.decode) the shard threads queue the compact form of the items
+    instead of the pyral objects. `ac` may also be a WsapiJson, whose items are dicts
+    (decode with RowCodec.decode_json).
+    """
+    def __init__(self, ac, entity, fetch, query, shards=4, concurrency=4, pagesize=200, max_pages=4, decode=None):
+        self.ac          = ac
+        self.entity      = entity
+        self.fetch       = fetch
+        self.query       = query
+        self.shards      = shards
+        self.concurrency = max(1, concurrency)
+        self.pagesize    = pagesize
+        self.buffered    = max(1, max_pages) * pagesize
+        self.decode      = decode
+        self.cancelled   = threading.Event()
+
+    def first_objectid(self, order):
+        response = self.ac.get(self.entity, fetch='ObjectID', query=self.query, order=order, pagesize=1, limit=1)
+        for item in response:
+            return int(item['ObjectID'] if isinstance(item, dict) else item.ObjectID)
+        return None
+
+    def ranges(self):
+        low = self.first_objectid('ObjectID')
+        if low is None:
+            return []
+        high = self.first_objectid('ObjectID desc')
+        return shard_ranges(low, high, self.shards)
+
+    def fetch_shard(self, low, high, items):
+        try:
+            if self.cancelled.is_set():
+                return
+            query = shard_query(self.query, low, high)
+            response = self.ac.get(self.entity, fetch=self.fetch, query=query, order="ObjectID", pagesize=self.pagesize)
+            decode = self.decode
+            for item in response:
+                if not put(items, decode(item) if decode else item, self.cancelled):
+                    return
+            put(items, DONE, self.cancelled)
+        except BaseException:
+            put(items, Failure(sys.exc_info()), self.cancelled)
+
+    def __iter__(self):
+        ranges = self.ranges()
+        if not ranges:
+            return
+        self.cancelled = threading.Event()
+        queues = [Queue(maxsize=self.buffered) for _ in ranges]
+        executor = ThreadPoolExecutor(max_workers=min(self.concurrency, len(ranges)))
+        try:
+            # submitted in ObjectID order; the pool starts them in that order as workers free up
+            for (low, high), items in zip(ranges, queues):
+                executor.submit(self.fetch_shard, low, high, items)
+            for items in queues:
+                while True:
+                    item = items.get()
+                    if item is DONE:
+                        break
+                    if isinstance(item, Failure):
+                        raise item.exc_info[1].with_traceback(item.exc_info[2])
+                    yield item
+        finally:
+            self.cancelled.set()
+            executor.shutdown(wait=False)
@@ -0,0 +1,158 @@
+import os
+import re
+import gzip
+import json
+from sharded_fetch import ShardedFetch
+from schema_cache import TypeDef
+from wsapi_json import loads
+
+META = 'meta.json'
+
+
+class WsapiSource:
+    """
+    The live source of typedefs and items: AC WSAPI on a pyral connection. Typedefs go through
+    the schema cache when there is one; items are pyral objects, or the dicts of the WSAPI JSON
+    when `wsapi` is given (ac.backend: json), fetched in ObjectID ranges when shards > 1.
+    """
+    def __init__(self, ac, wsapi=None, cache=None, shards=1, concurrency=4, pagesize=200, max_pages=4):
+        self.ac          = ac
+        self.wsapi       = wsapi
+        self.cache       = cache
+        self.shards      = shards
+        self.concurrency = concurrency
+        self.pagesize    = pagesize
+        self.max_pages   = max_pages
+
+    @property
+    def received(self):
+        # bytes of the responses per entity, only known for the JSON backend
+        return self.wsapi.received if self.wsapi else {}
+
+    @property
+    def decodes(self):
+        # whether items() yields the compact form of the items (RowCodec.decode) rather than the items
+        return self.shards > 1 or self.wsapi is not None
+
+    def typedef(self, entity, refresh=False):
+        if self.cache is None:
+            return self.ac.typedef(entity)
+        return self.cache.get(self.ac, entity, refresh)
+
+    def client(self, codec=None):
+        # what issues the queries and how its items are decoded
+        if self.wsapi:
+            return self.wsapi, codec.decode_json if codec else None
+        return self.ac, codec.decode if codec else None
+
+    def items(self, entity, codec, query):
+        client, decode = self.client(codec)
+        if self.shards > 1:
+            # decoded in the shard threads
+            return ShardedFetch(client, entity, codec.fetch, query, shards=self.shards, concurrency=self.concurrency,
+                                pagesize=self.pagesize, max_pages=self.max_pages, decode=decode)
+        if self.wsapi:
+            return self.wsapi.get(entity, fetch=codec.fetch, query=query, order="ObjectID",
+                                  pagesize=self.pagesize, decode=decode)
+        return self.ac.get('%s' % entity, fetch=codec.fetch, query=query, order="ObjectID", pagesize=self.pagesize)
+
+    def page(self, entity, codec, query, start):
+        # one request: (total number of items of the query, decoded items of the page starting at `start`)
+        if self.wsapi:
+            result = self.wsapi.request(entity, codec.fetch, query, "ObjectID", self.pagesize, start)
+            return int(result['TotalResultCount']), [codec.decode_json(item) for item in result['Results']]
+        response = self.ac.get('%s' % entity, fetch=codec.fetch, query=query, order="ObjectID",
+                               pagesize=self.pagesize, start=start, limit=self.pagesize)
+        raws = [codec.decode(item) for item in response]
+        return getattr(response, 'resultCount', len(raws)), raws
+
+    def objectids(self, entity, query):
+        # every ObjectID in scope of `query` in ascending order, fetching nothing but ObjectID
+        client = self.client()[0]
+        if self.shards > 1:
+            response = ShardedFetch(client, entity, 'ObjectID', query, shards=self.shards,
+                                    concurrency=self.concurrency, pagesize=2000, max_pages=self.max_pages)
+        else:
+            response = client.get('%s' % entity, fetch='ObjectID', query=query, order="ObjectID", pagesize=2000)
+        for item in response:
+            yield int(item['ObjectID'] if self.wsapi else item.ObjectID)
+
+
+def page_files(directory, entity):
+    # the recorded pages of `entity` in page order: <Entity>_<n>.json, or <Entity>_<n>.json.gz
+    pattern = re.compile(r'%s_(\d+)\.json(\.gz)?$' % re.escape(entity))
+    pages = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match:
+            pages.append((int(match.group(1)), os.path.join(directory, name)))
+    return [path for index, path in sorted(pages)]
+
+def read_page(path):
+    # a recorded page: WSAPI's {"QueryResult": {"Results": [...]}} or just {"Results": [...]}
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as page:
+        content = loads(page.read())
+    return content.get('QueryResult', content)['Results']
+
+def write_page(directory, entity, index, results, compress=False):
+    path = os.path.join(directory, '%s_%d.json%s' % (entity, index, '.gz' if compress else ''))
+    opener = gzip.open if compress else open
+    with opener(path, 'wt') as page:
+        json.dump({'Results': results}, page)
+    return path
+
+
+class ReplaySource:
+    """
+    Typedefs and items replayed from files (ac.source: replay), e.g. recorded by run.py ... record:
+    the typedefs in <directory>/meta.json ({"Results": [typedef, ...]}, the playground format) and
+    the pages of each entity in <directory>/<Entity>_<n>.json, optionally gzipped. Pages are
+    replayed as recorded, in ObjectID order, whatever the query: nothing goes over the network,
+    so the database side of a sync can be profiled on its own.
+    """
+    decodes = True
+
+    def __init__(self, directory, pagesize=200):
+        self.directory = directory
+        self.pagesize  = pagesize
+        self.counts    = {}
+        self.received  = {}    # bytes of the recorded pages read per entity
+
+    def typedef(self, entity, refresh=False):
+        with open(os.path.join(self.directory, META)) as meta:
+            typedefs = json.load(meta)['Results']
+        for typedef in typedefs:
+            if (typedef.get('ElementName') or typedef.get('Name')) == entity:
+                return TypeDef.from_dict(typedef)
+        raise ValueError("%s: no typedef in %s" % (entity, os.path.join(self.directory, META)))
+
+    def read(self, entity, path):
+        self.received[entity] = self.received.get(entity, 0) + os.path.getsize(path)
+        return read_page(path)
+
+    def pages(self, entity):
+        for path in page_files(self.directory, entity):
+            yield self.read(entity, path)
+
+    def items(self, entity, codec, query):
+        decode = codec.decode_json
+        for page in self.pages(entity):
+            for result in page:
+                yield decode(result)
+
+    def page(self, entity, codec, query, start):
+        # the recorded items start .. start + pagesize - 1, reading only the files that hold them
+        if entity not in self.counts:
+            self.counts[entity] = [(path, len(read_page(path))) for path in page_files(self.directory, entity)]
+        total = sum([count for path, count in self.counts[entity]])
+        raws, first, end = [], 1, start + self.pagesize
+        for path, count in self.counts[entity]:
+            if first < end and start < first + count:
+                page = self.read(entity, path)[max(start, first) - first:end - first]
+                raws.extend([codec.decode_json(result) for result in page])
+            first += count
+        return total, raws
+
+    def objectids(self, entity, query):
+        return iter(sorted(set([int(result['ObjectID']) for page in self.pages(entity) for result in page])))
@@ -0,0 +1,23 @@
+def split_statements(entity, history, codec, stage):
+    """
+    The two statements merging a staged page into the split layout (db.layout: split), run in
+    the entity's transaction: the current versions of staged items whose tracked values differ
+    are appended to `history`, closed at %(now)s, and the staged rows are upserted into the
+    current table, which has one row per ObjectID.
+    """
+    columns = codec.columns
+    archive_sql = ("INSERT INTO %s (%s,_fingerprint,_start,_end) SELECT %s,t._fingerprint,t._start,%%(now)s "
+                   "FROM %s t JOIN %s s ON t.ObjectID = s.ObjectID WHERE t._fingerprint IS DISTINCT FROM s._fingerprint" %
+                   (history, columns, ','.join(['t.%s' % field for field in codec.fields]), entity, stage))
+    upsert_sql = ("INSERT INTO %s (%s,_fingerprint,_start) SELECT %s,s._fingerprint,%%(now)s FROM %s s "
+                  "ON CONFLICT (ObjectID) DO UPDATE SET %s,_fingerprint = EXCLUDED._fingerprint,_start = EXCLUDED._start "
+                  "WHERE %s._fingerprint IS DISTINCT FROM EXCLUDED._fingerprint" %
+                  (entity, columns, ','.join(['s.%s' % field for field in codec.fields]), stage,
+                   ','.join(['%s = EXCLUDED.%s' % (field, field) for field in codec.fields]), entity))
+    return archive_sql, upsert_sql
+
+def move_deleted_sql(entity, history, codec):
+    # parameters: the ids of the current rows of the missing items and the time they were found missing
+    return ("WITH gone AS (DELETE FROM %s WHERE id = ANY(%%s) RETURNING %s,_fingerprint,_start) "
+            "INSERT INTO %s (%s,_fingerprint,_start,_end,_deleted) SELECT %s,_fingerprint,_start,%%s,true FROM gone" %
+            (entity, codec.columns, history, codec.columns, codec.columns))
@@ -0,0 +1,74 @@
+import threading
+from datetime import timedelta
+from rowcodec import parse_date
+
+SYNC_STATE = 'ac2pg_sync_state'
+
+
+class Watermark:
+    """
+    High-water mark of an entity: the greatest (LastUpdateDate, ObjectID) seen in a sync.
+    LastUpdateDate is kept as the ISO 8601 string WSAPI returns, which sorts chronologically.
+    """
+    def __init__(self, entity, last_update_date=None, last_objectid=None):
+        self.entity           = entity
+        self.last_update_date = last_update_date
+        self.last_objectid    = last_objectid
+        self.lock             = threading.Lock()
+
+    def observe(self, codec, raws):
+        # raws are decoded items of one page, see RowCodec.decode
+        if not raws:
+            return
+        lud, oid = codec.lud, codec.oid
+        high = max([(raw[lud], raw[oid]) for raw in raws if raw[lud]] or [(None, None)])
+        if high[0] is None:
+            return
+        with self.lock:
+            if self.last_update_date is None or high > (self.last_update_date, self.last_objectid):
+                self.last_update_date, self.last_objectid = high
+
+    def query(self, query, overlap=0):
+        # the configured query restricted to items changed since the watermark
+        conditions = list(query) if isinstance(query, (list, tuple)) else ([query] if query else [])
+        if self.last_update_date is None:
+            return query
+        if overlap:
+            since = parse_date(self.last_update_date) - timedelta(seconds=overlap)
+            conditions.append('LastUpdateDate >= %s' % since.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z')
+        else:
+            conditions.append('((LastUpdateDate > %s) OR ((LastUpdateDate = %s) AND (ObjectID > %s)))' %
+                              (self.last_update_date, self.last_update_date, self.last_objectid))
+        return conditions
+
+
+def ensure_sync_state(cursor):
+    # to be run on an autocommit connection: entity workers (db.workers) may get here at the
+    # same time and CREATE TABLE IF NOT EXISTS alone races, so creation is serialized with a
+    # session lock that is released as soon as the table is committed
+    cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", (SYNC_STATE,))
+    try:
+        cursor.execute("CREATE TABLE IF NOT EXISTS %s (entity text PRIMARY KEY, last_update_date text, "
+                       "last_objectid bigint, synced_at timestamp with time zone)" % SYNC_STATE)
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (SYNC_STATE,))
+
+def load_watermark(cursor, entity):
+    cursor.execute("SELECT last_update_date, last_objectid FROM " + SYNC_STATE + " WHERE entity = %s", (entity,))
+    row = cursor.fetchone()
+    return Watermark(entity, *row) if row else Watermark(entity)
+
+def reset_watermark(cursor, entity):
+    # the table of the entity was just created: whatever was synced into a dropped one is gone
+    cursor.execute("DELETE FROM " + SYNC_STATE + " WHERE entity = %s", (entity,))
+    return Watermark(entity)
+
+def save_watermark(cursor, watermark):
+    # written in the transaction of the entity's data, so it moves only when the data commits
+    if watermark.last_update_date is None:
+        return
+    cursor.execute("INSERT INTO " + SYNC_STATE + " (entity, last_update_date, last_objectid, synced_at) "
+                   "VALUES (%s, %s, %s, now()) ON CONFLICT (entity) DO UPDATE SET "
+                   "last_update_date = EXCLUDED.last_update_date, last_objectid = EXCLUDED.last_objectid, "
+                   "synced_at = EXCLUDED.synced_at",
+                   (watermark.entity, watermark.last_update_date, watermark.last_objectid,))
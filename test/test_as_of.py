@@ -0,0 +1,114 @@
+import json
+from datetime import datetime, timedelta, timezone
+import yaml
+import psycopg2
+import pytest
+from dbconnector import DBConnector
+from sources import META
+
+# runs against the database of config.yml, like test_db_conn.py; only the asofitem* objects are created and dropped
+ENTITY = 'AsOfItem'
+T0 = datetime(2017, 1, 2, tzinfo=timezone.utc)
+T1 = datetime(2017, 1, 3, 12, tzinfo=timezone.utc)
+T2 = datetime(2017, 1, 5, tzinfo=timezone.utc)
+TICK = timedelta(microseconds=1)
+
+
+def database():
+    try:
+        with open('config.yml') as config:
+            db = yaml.safe_load(config)['db']
+        psycopg2.connect(database=db['name'], user=db['user'], password=db['password'], host=db['host'],
+                         port=db['port']).close()
+    except (IOError, OSError, KeyError, TypeError, psycopg2.Error) as ex:
+        pytest.skip('needs the database of config.yml: %s' % ex)
+    return db
+
+
+class Connector(DBConnector):
+    # a DBConnector on a config dict, with the AsOfItem typedef replayed from `directory`
+    def read_config(self, config):
+        return config
+
+
+def drop(connector):
+    with connector.pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("DROP TABLE IF EXISTS asofitem, asofitem_history, asofitem_state_values CASCADE")
+        cursor.execute("DROP TYPE IF EXISTS asofitem_state")
+        db.commit()
+
+@pytest.fixture(params=[('versions', 'check'), ('split', 'check'), ('split', 'enum'), ('split', 'lookup')])
+def connector(request, tmpdir):
+    layout, storage = request.param
+    with open(str(tmpdir.join(META)), 'w') as meta:
+        json.dump({'Results': [{'ElementName': ENTITY, 'Attributes': [
+            {'ElementName': 'ObjectID', 'AttributeType': 'INTEGER'},
+            {'ElementName': 'State', 'AttributeType': 'STATE', 'AllowedValues': ['Submitted', 'Open', 'Closed']}]}]},
+            meta)
+    db = dict(database(), tables=ENTITY, layout=layout, enum_storage=storage, pool={'min': 1, 'max': 2})
+    connector = Connector({'ac': {'source': 'replay', 'fetch': 'ObjectID,State', 'query': None},
+                           'replay': {'directory': str(tmpdir)}, 'db': db}, entities=[ENTITY])
+    drop(connector)
+    connector.create_tables_n_columns()
+    yield connector
+    drop(connector)
+    connector.close()
+
+def write(connector, versions):
+    # (ObjectID, State, _start, _end) written to the table the layout keeps them in, ids for lookup storage
+    with connector.pool.connection() as db:
+        cursor = db.cursor()
+        for oid, state, start, end in versions:
+            table = connector.history_table(ENTITY) if end else ENTITY
+            value = state
+            if connector.enum_storage() == 'lookup':
+                cursor.execute("SELECT id FROM asofitem_state_values WHERE value = %s", (state,))
+                value = cursor.fetchone()[0]
+            cursor.execute("INSERT INTO %s (ObjectID, State, _start, _end) VALUES (%%s, %%s, %%s, %%s)" % table,
+                           (oid, value, start, end))
+        db.commit()
+
+def test_versions_valid_at_a_moment(connector):
+    write(connector, [(1, 'Submitted', T0, T1), (1, 'Open', T1, T2), (1, 'Closed', T2, None),
+                      (2, 'Open', T1, T2), (3, 'Submitted', T2, None)])
+    as_of = lambda moment: list(connector.as_of(ENTITY, moment))
+    assert as_of(T0 - TICK) == []
+    # [_start, _end): a version is valid from its start up to, not including, its end
+    assert as_of(T0) == [(1, 'Submitted')]
+    assert as_of(T1 - TICK) == [(1, 'Submitted')]
+    assert as_of(T1) == [(1, 'Open'), (2, 'Open')]
+    assert as_of('2017-01-04T00:00:00Z') == [(1, 'Open'), (2, 'Open')]
+    # item 2 was closed at T2 without a new version: deleted, or out of scope
+    assert as_of(T2) == [(1, 'Closed'), (3, 'Submitted')]
+    assert as_of(datetime(2030, 1, 1, tzinfo=timezone.utc)) == [(1, 'Closed'), (3, 'Submitted')]
+
+def test_fields_and_batches(connector):
+    write(connector, [(oid, 'Open', T0, T1 if oid % 2 else None) for oid in range(1, 8)])
+    assert list(connector.as_of(ENTITY, T0, ['State', 'ObjectID'], batch=2)) == \
+           [('Open', oid) for oid in range(1, 8)]
+    assert list(connector.as_of(ENTITY, T1, ['ObjectID'], batch=2)) == [(2,), (4,), (6,)]
+
+def test_fields_without_objectid(connector):
+    write(connector, [(2, 'Open', T0, None), (1, 'Submitted', T0, T1), (1, 'Closed', T1, None), (3, 'Open', T0, T1)])
+    # still in ObjectID order
+    assert list(connector.as_of(ENTITY, T0, ['State'])) == [('Submitted',), ('Open',), ('Open',)]
+    assert list(connector.as_of(ENTITY, T1, ['State'], batch=1)) == [('Closed',), ('Open',)]
+
+def test_tables_share_the_enum_type_or_lookup_table(connector):
+    # with the split layout the history table stores the same values as the current one
+    storage, tables = connector.enum_storage(), [table.lower() for table in connector.tables(ENTITY)]
+    with connector.pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT table_name, udt_name FROM information_schema.columns WHERE table_schema = current_schema() "
+                       "AND column_name = 'state' AND table_name = ANY(%s) ORDER BY table_name", (tables,))
+        types = cursor.fetchall()
+        cursor.execute("SELECT conrelid::regclass::text, confrelid::regclass::text FROM pg_constraint "
+                       "WHERE contype = 'f' AND conrelid::regclass::text LIKE 'asofitem%' ORDER BY 1")
+        references = cursor.fetchall()
+        cursor.execute("SELECT typname FROM pg_type WHERE typname LIKE 'asofitem%state%' AND typtype = 'e'")
+        enums = cursor.fetchall()
+    udt = {'check': 'text', 'enum': 'asofitem_state', 'lookup': 'int2'}[storage]
+    assert types == [(table, udt) for table in tables]
+    assert enums == ([('asofitem_state',)] if storage == 'enum' else [])
+    assert references == ([(table, 'asofitem_state_values') for table in tables] if storage == 'lookup' else [])
@@ -0,0 +1,124 @@
+import time
+from types import SimpleNamespace
+from rowcodec import RowCodec
+from async_engine import AsyncEngine
+from sources import WsapiSource
+from metrics import Metrics
+from dbpool import PoolError
+
+
+class FakeResponse(list):
+    pass
+
+class FakeAC:
+    def __init__(self, count):
+        self.count = count
+
+    def get(self, entity, fetch, query, order, pagesize, start, limit):
+        response = FakeResponse(SimpleNamespace(ObjectID=oid, ScheduleState='Defined')
+                                for oid in range(start, min(start + limit, self.count + 1)))
+        response.resultCount = self.count
+        return response
+
+class FakeConnection:
+    def __init__(self):
+        self.committed = False
+
+    def cursor(self):
+        return None
+
+    def commit(self):
+        self.committed = True
+
+class FakePool:
+    def __init__(self, maxconn=4):
+        self.maxconn  = maxconn
+        self.used     = 0
+        self.returned = []
+
+    def getconn(self):
+        # like ConnectionPool with a short timeout
+        if self.used == self.maxconn:
+            raise PoolError("no connection available after 1s (max %s)" % self.maxconn)
+        self.used += 1
+        return FakeConnection()
+
+    def putconn(self, conn):
+        self.used -= 1
+        self.returned.append(conn)
+
+class FakeConnector:
+    def __init__(self, count, pagesize, maxconn=4):
+        self.entities = ['Defect', 'HierarchicalRequirement']
+        self.codecs   = dict((entity, RowCodec(entity, [{'ObjectID': 'INTEGER'}, {'ScheduleState': 'STATE'}]))
+                             for entity in self.entities)
+        self.config   = {'ac': {'query': None}, 'db': {}}
+        self.source   = WsapiSource(FakeAC(count), pagesize=pagesize)
+        self.pagesize = pagesize
+        self.pool     = FakePool(maxconn)
+        self.metrics  = Metrics()
+        self.written  = dict((entity, []) for entity in self.entities)
+        self.finished = []
+        self.watermarks = {}
+
+    def ensure_sync_state(self):
+        pass
+
+    def query_for(self, entity):
+        return None
+
+    def writer(self, action, cursor, entity):
+        return self.written[entity].append
+
+    def finish(self, action, cursor, entity):
+        self.finished.append(entity)
+
+
+def test_pages_written_in_order():
+    connector = FakeConnector(count=95, pagesize=10)
+    AsyncEngine(connector, in_flight=3).run('update')
+    for entity in connector.entities:
+        pages = connector.written[entity]
+        assert len(pages) == 10
+        assert [row[0] for page in pages for row in page] == list(range(1, 96))
+    assert sorted(connector.finished) == sorted(connector.entities)
+    assert [conn.committed for conn in connector.pool.returned] == [True, True]
+    counters = connector.metrics.to_dict()['entities']['Defect']['counters']
+    assert (counters['pages_fetched'], counters['items_seen']) == (10, 95)
+
+def test_empty_entity():
+    connector = FakeConnector(count=0, pagesize=10)
+    AsyncEngine(connector).run('update')
+    assert connector.written == {'Defect': [], 'HierarchicalRequirement': []}
+
+def test_entities_wait_for_a_pooled_connection():
+    connector = FakeConnector(count=35, pagesize=10, maxconn=1)
+    def writer(action, cursor, entity):
+        def write(rows):
+            time.sleep(0.01)
+            connector.written[entity].append(rows)
+        return write
+    connector.writer = writer
+    AsyncEngine(connector, in_flight=2).run('update')
+    assert [len(connector.written[entity]) for entity in connector.entities] == [4, 4]
+    assert [conn.committed for conn in connector.pool.returned] == [True, True]
+
+def test_failed_entity_returns_every_connection():
+    connector = FakeConnector(count=95, pagesize=10)
+    def writer(action, cursor, entity):
+        def write(rows):
+            if entity == 'Defect':
+                raise ValueError('insert failed')
+            time.sleep(0.01)
+            connector.written[entity].append(rows)
+        return write
+    connector.writer = writer
+    try:
+        AsyncEngine(connector, in_flight=3).run('update')
+    except ValueError:
+        # the other entity ran to its end before the loop was closed
+        assert len(connector.written['HierarchicalRequirement']) == 10
+        assert connector.pool.used == 0
+        assert sorted([conn.committed for conn in connector.pool.returned]) == [False, True]
+        return
+    assert False
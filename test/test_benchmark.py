@@ -0,0 +1,34 @@
+from rowcodec import RowCodec
+from benchmark import SyntheticSource, field_types, bench_config
+
+def test_field_types_follow_the_mix():
+    assert field_types(5, 'STRING=2,STATE=1') == ['STRING', 'STRING', 'STATE', 'STRING', 'STRING']
+    try:
+        field_types(1, 'WEBLINK=1')
+    except ValueError:
+        return
+    assert False
+
+def test_changed_items_per_phase():
+    source = SyntheticSource(1000, 6, changes=[0.0, 0.1, 0.5])
+    codec = RowCodec('BenchItem', [{attr.ElementName: attr.AttributeType}
+                                   for attr in source.typedef('BenchItem').Attributes])
+    phases = [list(SyntheticSource(1000, 6, changes=[0.0, 0.1, 0.5], phase=phase).items('BenchItem', codec, None))
+              for phase in range(4)]
+    changed = [sum(1 for before, after in zip(phases[phase - 1], phases[phase]) if before != after)
+               for phase in range(1, 4)]
+    assert changed == [0, 100, 500]
+    assert [raw[0] for raw in phases[0]] == list(source.objectids('BenchItem', None))
+
+def test_pages_match_the_items():
+    source = SyntheticSource(25, 3, pagesize=10)
+    codec = RowCodec('BenchItem', [{'ObjectID': 'INTEGER'}, {'Name': 'STRING'}])
+    pages = [source.page('BenchItem', codec, None, start) for start in (1, 11, 21)]
+    assert [total for total, raws in pages] == [25] * 3
+    assert [raw for total, raws in pages for raw in raws] == list(source.items('BenchItem', codec, None))
+
+def test_bench_config_overrides():
+    config = bench_config({'ac': {'query': 'x'}, 'db': {'tables': 'Defect', 'load': 'insert'}}, SyntheticSource(1, 1),
+                          ['db.load=copy', 'db.partition.months=3'])
+    assert config['db'] == {'tables': 'BenchItem', 'workers': 1, 'load': 'copy', 'partition': {'months': 3}}
+    assert config['ac']['fetch'] == 'ObjectID,Name,CreationDate,LastUpdateDate,c_BenchString0'
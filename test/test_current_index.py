@@ -0,0 +1,34 @@
+from current_index import CurrentIndex, UNCHANGED, CHANGED, NEW
+
+A, B, C = b'a' * 16, b'b' * 16, b'c' * 16
+
+def index_of(rows):
+    index = CurrentIndex('Defect')
+    for oid, id, digest in rows:
+        index.oids.append(oid)
+        index.ids.append(id)
+        index.fingerprints += digest
+    return index
+
+def test_merge_diff():
+    index = index_of([(10, 1, A), (20, 2, A), (30, 3, A)])
+    assert index.diff(5, A) == (NEW, None)
+    assert index.diff(10, A) == (UNCHANGED, None)
+    assert index.diff(20, B) == (CHANGED, 2)
+    assert index.diff(25, A) == (NEW, None)
+    assert index.diff(40, A) == (NEW, None)
+    assert index.changed == 1
+    assert index.new == 3
+
+def test_repeated_items_are_handled_once():
+    index = index_of([(10, 1, A), (20, 2, A)])
+    assert index.diff(20, B) == (CHANGED, 2)
+    assert index.diff(20, B) == (UNCHANGED, None)
+    assert index.diff(20, C) == (UNCHANGED, None)
+    assert index.diff(15, A) == (NEW, None)
+    assert index.diff(15, A) == (UNCHANGED, None)
+
+def test_out_of_order_lookup():
+    index = index_of([(10, 1, A), (20, 2, A), (30, 3, A)])
+    assert index.diff(30, A) == (UNCHANGED, None)
+    assert index.diff(10, B) == (CHANGED, 1)
@@ -10,8 +10,8 @@ conn = instantiate(config_file)
 
 
 def get_tables():
-    if conn.db:
-        cur = conn.db.cursor()
+    with conn.pool.connection() as db:
+        cur = db.cursor()
         tables = []
         try:
             cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
@@ -22,8 +22,8 @@ def get_tables():
             return tables
 
 def get_columns(table):
-    if conn.db:
-        cur = conn.db.cursor()
+    with conn.pool.connection() as db:
+        cur = db.cursor()
         columns = []
         try:
             cur.execute("SELECT * FROM %s; ", (AsIs(table),))
@@ -34,9 +34,15 @@ def get_columns(table):
            return columns
 
 def test_db_connection():
-    db = conn.db
-    assert db
-    db.close()
+    with conn.pool.connection() as db:
+        assert db
+        assert not db.closed
+
+def test_pool_reuses_connections():
+    with conn.pool.connection() as db:
+        first = db
+    with conn.pool.connection() as db:
+        assert db is first
 
 
 def test_get_tables():
@@ -49,7 +55,7 @@ def test_get_tables():
         assert len(columns)
         for column in columns:
             print("        %s" %column)
-    conn.db.close()
+    conn.close()
 
     #
     # expected output:
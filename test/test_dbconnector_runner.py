@@ -0,0 +1,67 @@
+import os
+import json
+import multiprocessing
+import pytest
+import dbconnector_runner
+from dbconnector_runner import DBConnectorRunner
+from metrics import Metrics
+
+# the fake connector is handed to the workers by forking the patched module
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='needs fork workers')
+
+synced = None    # a directory the workers mark their entities in
+
+
+class FakeConnector:
+    def __init__(self, config, entities=None):
+        self.entities = entities
+        self.metrics  = Metrics()
+
+    def update(self):
+        for entity in self.entities:
+            with open(os.path.join(synced, '%s.%d' % (entity, os.getpid())), 'w'):
+                pass
+            self.metrics.count(entity, 'items_seen', 10)
+            self.metrics.count('all', 'items_seen', 1)
+            if entity == 'Broken':
+                raise ValueError('Broken: insert failed')
+
+    def close(self):
+        pass
+
+
+def run(tmpdir, monkeypatch, tables):
+    global synced
+    synced = str(tmpdir.mkdir('synced'))
+    settings = {'db': {'workers': 2, 'tables': tables}, 'metrics': {'json': str(tmpdir.join('metrics.json'))}}
+    monkeypatch.setattr(dbconnector_runner, 'read_config', lambda config: settings)
+    monkeypatch.setattr(dbconnector_runner, 'DBConnector', FakeConnector)
+    DBConnectorRunner('config.yml').run(['config.yml', 'update'])
+
+def outcome(tmpdir):
+    # the merged metrics and the entities synced, once per worker run
+    return (json.loads(tmpdir.join('metrics.json').read()),
+            sorted([name.split('.')[0] for name in os.listdir(synced)]))
+
+def test_each_entity_synced_once(tmpdir, monkeypatch):
+    run(tmpdir, monkeypatch, 'Defect, Task, HierarchicalRequirement')
+    metrics, entities = outcome(tmpdir)
+    assert entities == ['Defect', 'HierarchicalRequirement', 'Task']
+    # the metrics of the workers are merged
+    assert metrics['action'] == 'update'
+    assert metrics['entities']['all']['counters'] == {'items_seen': 3}
+    assert metrics['entities']['Task']['counters'] == {'items_seen': 10}
+
+def test_worker_error_fails_the_run(tmpdir, monkeypatch):
+    with pytest.raises(SystemExit) as exit:
+        run(tmpdir, monkeypatch, 'Defect, Broken, Task')
+    assert exit.value.code == 1
+    # the other entities are still synced, and the metrics of the failed one are kept
+    metrics, entities = outcome(tmpdir)
+    assert entities == ['Broken', 'Defect', 'Task']
+    assert metrics['entities']['Broken']['counters'] == {'items_seen': 10}
+    assert metrics['entities']['all']['counters'] == {'items_seen': 3}
+
+def test_no_entities(tmpdir, monkeypatch):
+    run(tmpdir, monkeypatch, '')
+    assert os.listdir(synced) == []
@@ -0,0 +1,157 @@
+import time
+import threading
+import psycopg2
+from psycopg2 import extensions
+from dbpool import ConnectionPool, PoolError
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql):
+        self.conn.checks += 1
+        if self.conn.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+class FakeConnection:
+    def __init__(self):
+        self.closed     = 0
+        self.broken     = False
+        self.checks     = 0
+        self.autocommit = False
+        self.status     = extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def close(self):
+        self.closed = 1
+
+class FakePool(ConnectionPool):
+    def __init__(self, *args, **kwargs):
+        self.opened        = []
+        self.connect_delay = None    # an Event that connect() waits for
+        self.failures      = 0       # connect() attempts to fail
+        ConnectionPool.__init__(self, *args, **kwargs)
+
+    def connect(self):
+        if self.connect_delay:
+            self.connect_delay.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise psycopg2.OperationalError('could not connect to server')
+        conn = FakeConnection()
+        self.opened.append(conn)
+        return conn
+
+
+def test_reuses_returned_connections():
+    pool = FakePool(minconn=1, maxconn=2)
+    conn = pool.getconn()
+    assert conn is pool.opened[0] and conn.checks == 1
+    conn.status = extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    # rolled back when returned
+    assert conn.status == extensions.TRANSACTION_STATUS_IDLE
+    assert pool.getconn() is conn
+    assert len(pool.opened) == 1
+
+def test_timeout():
+    pool = FakePool(minconn=0, maxconn=1, timeout=0.1)
+    pool.getconn()
+    started = time.time()
+    try:
+        pool.getconn()
+    except PoolError:
+        assert time.time() - started >= 0.1
+        return
+    assert False
+
+def test_waiter_gets_the_returned_connection():
+    pool = FakePool(minconn=0, maxconn=1, timeout=5)
+    conn = pool.getconn()
+    threading.Timer(0.1, pool.putconn, (conn,)).start()
+    assert pool.getconn() is conn
+
+def test_broken_connection_is_replaced():
+    pool = FakePool(minconn=1, maxconn=1)
+    broken = pool.opened[0]
+    broken.broken = True
+    conn = pool.getconn()
+    assert conn is not broken and broken.closed
+    assert pool.used == set([conn])
+
+def test_no_health_check():
+    pool = FakePool(minconn=1, health_check=False)
+    assert pool.getconn().checks == 0
+
+def test_idle_connections_are_recycled():
+    pool = FakePool(minconn=0, maxconn=3, max_idle=60)
+    first, second, third = pool.getconn(), pool.getconn(), pool.getconn()
+    for conn in (first, second):
+        pool.putconn(conn)
+    # idle for longer than max_idle
+    pool.idle = [(conn, returned_at - 120) for conn, returned_at in pool.idle]
+    pool.putconn(third)
+    assert first.closed and second.closed and not third.closed
+    assert [conn for conn, returned_at in pool.idle] == [third]
+    # an expired connection is not handed out
+    pool.idle[0] = (third, time.time() - 120)
+    conn = pool.getconn()
+    assert conn is not third and third.closed
+
+def test_recycling_keeps_minconn():
+    pool = FakePool(minconn=1, maxconn=1, max_idle=60)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    pool.idle = [(conn, time.time() - 120)]
+    pool.putconn(pool.getconn())
+    assert len(pool.idle) == 1
+
+def test_connect_outside_the_lock():
+    pool = FakePool(minconn=1, maxconn=2, timeout=5)
+    conn = pool.getconn()
+    pool.connect_delay = threading.Event()
+    opening = threading.Thread(target=pool.getconn)
+    opening.start()
+    time.sleep(0.1)
+    # while the second connection is being opened, the first one is returned and borrowed again
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    pool.connect_delay.set()
+    opening.join()
+    assert len(pool.opened) == 2 and len(pool.used) == 2 and pool.opening == 0
+
+def test_failed_connect_frees_the_slot():
+    pool = FakePool(minconn=0, maxconn=1, timeout=0.1)
+    pool.failures = 1
+    try:
+        pool.getconn()
+    except psycopg2.OperationalError:
+        pass
+    assert pool.opening == 0
+    assert pool.getconn() is pool.opened[0]
+
+def test_closed_pool():
+    pool = FakePool(minconn=2)
+    conn = pool.getconn()
+    pool.closeall()
+    assert all(conn.closed for conn in pool.opened)
+    try:
+        pool.getconn()
+    except PoolError:
+        return
+    assert False
@@ -0,0 +1,123 @@
+import os
+from datetime import datetime, timezone
+import pytest
+from rowcodec import RowCodec
+
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.parquet
+from export import ParquetExport, arrow_schema, arrow_type
+from schema_planner import COLUMN_TYPES
+
+codec = RowCodec('Defect', [{'CreationDate': 'DATE'}, {'ObjectID': 'INTEGER'}, {'ScheduleState': 'STATE'},
+                            {'PlanEstimate': 'QUANTITY'}, {'Blocked': 'BOOLEAN'}])
+
+def test_arrow_schema():
+    schema = arrow_schema(codec)
+    assert schema.names == ['CreationDate', 'ObjectID', 'ScheduleState', 'PlanEstimate', 'Blocked',
+                            '_start', '_end', '_deleted']
+    assert schema.types[:5] == [pyarrow.timestamp('us', tz='UTC'), pyarrow.int64(), pyarrow.string(),
+                                pyarrow.float64(), pyarrow.bool_()]
+
+def test_every_column_type_has_an_arrow_type():
+    # a type added to COLUMN_TYPES without an Arrow type fails here instead of exporting as string
+    for rally_type in COLUMN_TYPES:
+        assert rally_type == 'STRING' or arrow_type(rally_type) != pyarrow.string()
+    assert arrow_type('RATING') == pyarrow.string()
+
+def test_query():
+    columns = 'CreationDate,ObjectID,ScheduleState,PlanEstimate,Blocked,_start,_end,_deleted'
+    assert ParquetExport('export').query(codec, ['Defect']) == \
+           'SELECT %s FROM Defect WHERE _end IS NULL' % columns
+    assert ParquetExport('export', 'history').query(codec, ['Defect', 'Defect_history'], since='2017-01-01') == \
+           'SELECT %s FROM Defect WHERE (_start > %%(since)s OR _end > %%(closed_since)s) UNION ALL ' \
+           'SELECT %s FROM Defect_history WHERE (_start > %%(since)s OR _end > %%(closed_since)s)' % (columns, columns)
+
+
+def day(day):
+    return datetime(2017, 1, day, tzinfo=timezone.utc)
+
+def version(oid, state, start, end=None):
+    return (day(1), oid, state, 2.0, False, start, end, False)
+
+class FakeCursor:
+    # the export state table, and the versions `rows` as the result of any other query
+    def __init__(self, connection, rows=()):
+        self.connection = connection
+        self.rows       = list(rows)
+        self.itersize   = None
+        self.result     = None
+
+    def execute(self, sql, params=None):
+        if sql.startswith('SELECT last_start, last_end'):
+            self.result = self.connection.state
+        elif sql.startswith('INSERT INTO ac2pg_export_state'):
+            self.connection.state = params[1:]
+        elif params and 'since' in params:
+            self.connection.queries.append((sql, params))
+
+    def fetchone(self):
+        return self.result
+
+    def fetchmany(self, size):
+        fetched, self.rows = self.rows[:size], self.rows[size:]
+        return fetched
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self):
+        self.state   = None
+        self.queries = []
+        self.rows    = []
+
+    def cursor(self, name=None):
+        return FakeCursor(self, self.rows if name else ())
+
+def export(exporter, connection, rows, full=False):
+    connection.rows = rows
+    return exporter.export(connection, 'Defect', codec, ['Defect'], full)
+
+def read(directory):
+    table = pyarrow.parquet.read_table(os.path.join(directory, 'Defect'))
+    columns = arrow_schema(codec).names + ['exported_at']
+    return sorted([tuple(row[name] for name in columns) for row in table.to_pylist()], key=lambda row: row[-1])
+
+def test_current_export_replaces_the_snapshot(tmpdir):
+    exporter = ParquetExport(str(tmpdir), rows_per_file=2, batch=2)
+    connection = FakeConnection()
+    first = [version(oid, 'Defined', day(2)) for oid in range(1, 6)]
+    assert export(exporter, connection, first) == 5
+    # batches of 2 rows, 2 rows per file
+    assert len(tmpdir.join('Defect').listdir()[0].listdir()) == 3
+    assert [row[:-1] for row in read(str(tmpdir))] == first
+    second = [version(1, 'Defined', day(2)), version(2, 'Completed', day(3))]
+    assert export(exporter, connection, second) == 2
+    assert [row[:-1] for row in read(str(tmpdir))] == second
+    assert len(tmpdir.join('Defect').listdir()) == 1
+    # nothing current: an empty dataset
+    assert export(exporter, connection, []) == 0
+    assert tmpdir.join('Defect').listdir() == []
+    assert connection.state is None
+
+def test_history_export_appends_started_and_closed_versions(tmpdir):
+    exporter = ParquetExport(str(tmpdir), 'history')
+    connection = FakeConnection()
+    assert export(exporter, connection, [version(1, 'Defined', day(2)), version(2, 'Defined', day(3))]) == 2
+    assert connection.queries[-1][1] == {'since': None, 'closed_since': None}
+    assert connection.state == (day(3), None)
+    # the versions of the first export are closed: one by a new version, the other as deleted
+    closed = [version(1, 'Defined', day(2), day(5)), version(1, 'Completed', day(5)), version(2, 'Defined', day(3), day(6))]
+    assert export(exporter, connection, closed) == 3
+    assert connection.queries[-1] == (exporter.query(codec, ['Defect'], day(3)), {'since': day(3), 'closed_since': day(3)})
+    assert connection.state == (day(5), day(6))
+    export(exporter, connection, [])
+    assert connection.queries[-1][1] == {'since': day(5), 'closed_since': day(6)}
+    rows = read(str(tmpdir))
+    assert len(rows) == 5 and len(set(row[-1] for row in rows)) == 2
+    # the latest export of each version (ObjectID, _start)
+    latest = dict(((row[1], row[5]), row[:-1]) for row in rows)
+    assert sorted(latest.values(), key=lambda row: (row[1], row[5])) == closed
+    # --full starts over from all versions
+    export(exporter, connection, closed, full=True)
+    assert connection.queries[-1][1] == {'since': None, 'closed_since': None}
@@ -0,0 +1,61 @@
+import os
+import json
+from rowcodec import RowCodec
+from lookback import LookbackSource, SnapshotFileSource, snapshot_versions, hydrated
+
+fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+codec = RowCodec('Defect', [{'ObjectID': 'INTEGER'}, {'ScheduleState': 'STATE'}, {'PlanEstimate': 'QUANTITY'},
+                            {'State': 'RATING'}])
+
+def test_recorded_pages():
+    pages = list(SnapshotFileSource(fixtures).pages('Defect', codec.fetched))
+    assert [len(page) for page in pages] == [3, 2]
+
+def test_snapshot_versions():
+    source = SnapshotFileSource(fixtures)
+    versions = list(snapshot_versions(codec, source.pages('Defect', codec.fetched)))
+    assert [(row, valid_from, valid_to) for row, digest, valid_from, valid_to in versions] == [
+        ((83320385428, 'Defined', None, 'Submitted'), '2016-12-26T19:10:43.704Z', '2017-01-04T18:30:00.000Z'),
+        ((83320385428, 'In-Progress', 2.0, 'Open'),   '2017-01-04T18:30:00.000Z', None),
+        ((83320385700, 'Completed', 2.0, 'Fixed'),    '2016-12-26T19:10:59.458Z', '2016-12-28T09:00:00.000Z'),
+        ((83320385700, 'Accepted', 2.0, 'Closed'),    '2016-12-28T09:00:00.000Z', None),
+    ]
+    assert all(digest == codec.fingerprint(row) for row, digest, valid_from, valid_to in versions)
+
+class FakeResponse:
+    def __init__(self, results, total):
+        self.content = {'Results': results, 'TotalResultCount': total}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.content
+
+class FakeSession:
+    def __init__(self, total):
+        self.total  = total
+        self.bodies = []
+
+    def post(self, url, data, headers):
+        body = json.loads(data)
+        self.bodies.append(body)
+        count = max(0, min(body['pagesize'], self.total - body['start']))
+        return FakeResponse([{'ObjectID': body['start'] + index} for index in range(count)], self.total)
+
+def test_request_hydrates_drop_down_fields():
+    source = LookbackSource('rally1.rallydev.com', 1234, 5678, apikey='_abc', pagesize=2)
+    source.session = FakeSession(total=3)
+    assert hydrated(codec) == ['ScheduleState', 'State']
+    pages = list(source.pages('Defect', codec.fetched, hydrated(codec)))
+    assert [len(page) for page in pages] == [2, 1]
+    assert source.session.bodies[0] == {
+        'find'     : {'_TypeHierarchy': 'Defect', '_ProjectHierarchy': 5678},
+        'fields'   : ['ObjectID', 'ScheduleState', 'PlanEstimate', 'State', 'LastUpdateDate', '_ValidFrom', '_ValidTo'],
+        'hydrate'  : ['ScheduleState', 'State'],
+        'sort'     : {'ObjectID': 1, '_ValidFrom': 1},
+        'start'    : 0,
+        'pagesize' : 2,
+        'removeUnauthorizedSnapshots': True,
+    }
+    assert [body['start'] for body in source.session.bodies] == [0, 2]
@@ -0,0 +1,48 @@
+import json
+import logging
+from metrics import Metrics, JsonFormatter
+
+def sample():
+    metrics = Metrics()
+    metrics.count('Defect', 'items_seen', 200)
+    metrics.count('Defect', 'items_seen', 50)
+    metrics.count('Defect', 'rows_inserted', 3)
+    metrics.time('Defect', 'write', 0.25)
+    with metrics.timer('Defect', 'commit'):
+        pass
+    metrics.count('HierarchicalRequirement', 'items_seen', 7)
+    metrics.finish('update')
+    return metrics
+
+def test_to_dict_and_merge():
+    entities = sample().to_dict()['entities']
+    assert entities['Defect']['counters'] == {'items_seen': 250, 'rows_inserted': 3}
+    assert sorted(entities['Defect']['seconds']) == ['commit', 'write']
+    merged = Metrics()
+    merged.merge(sample().to_dict())
+    merged.merge(sample().to_dict())
+    assert merged.to_dict()['entities']['Defect']['counters'] == {'items_seen': 500, 'rows_inserted': 6}
+    assert json.loads(sample().to_json())['action'] == 'update'
+
+def test_prometheus_text():
+    lines = sample().to_prometheus().splitlines()
+    assert '# TYPE ac2pg_items_seen_total counter' in lines
+    assert 'ac2pg_items_seen_total{action="update",entity="Defect"} 250' in lines
+    assert 'ac2pg_items_seen_total{action="update",entity="HierarchicalRequirement"} 7' in lines
+    assert 'ac2pg_stage_seconds_total{action="update",entity="Defect",stage="write"} 0.25' in lines
+    # stages in pipeline order
+    stages = [line for line in lines if line.startswith('ac2pg_stage_seconds_total')]
+    assert 'stage="write"' in stages[0] and 'stage="commit"' in stages[1]
+
+def test_write(tmpdir):
+    paths = {'json': str(tmpdir.join('metrics.json')), 'prometheus': str(tmpdir.join('metrics.prom'))}
+    sample().write(paths)
+    assert json.load(open(paths['json']))['entities']['Defect']['counters']['rows_inserted'] == 3
+    assert open(paths['prometheus']).read().startswith('# HELP ac2pg_items_seen_total')
+    assert sorted(tmpdir.listdir()) == sorted([tmpdir.join('metrics.json'), tmpdir.join('metrics.prom')])
+
+def test_json_log_records():
+    record = logging.LogRecord('dbconnector', logging.INFO, __file__, 1, '%s: closed %d items', ('Defect', 2), None)
+    record.entity = 'Defect'
+    entry = json.loads(JsonFormatter().format(record))
+    assert (entry['message'], entry['entity'], entry['level']) == ('Defect: closed 2 items', 'Defect', 'INFO')
@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+from partitions import partition_start, add_months, partition_name, partition_lower, plan_partitions
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def test_partition_start():
+    assert partition_start(utc(2017, 5, 17, 13, 30)) == utc(2017, 5, 1)
+    assert partition_start(utc(2017, 5, 17), 3) == utc(2017, 4, 1)
+    assert partition_start(utc(2017, 12, 31), 12) == utc(2017, 1, 1)
+
+def test_add_months():
+    assert add_months(utc(2017, 11, 1), 3) == utc(2018, 2, 1)
+    assert add_months(utc(2017, 1, 1), -1) == utc(2016, 12, 1)
+
+def test_names():
+    assert partition_name('Defect', utc(2017, 2, 1)) == 'defect_p2017_02'
+    assert partition_lower('Defect', 'defect_p2017_02') == utc(2017, 2, 1)
+    assert partition_lower('Defect', 'defect_default') is None
+
+def test_plan_partitions():
+    assert plan_partitions('Defect', 1, utc(2017, 1, 20), utc(2017, 2, 20)) == [
+        "CREATE TABLE IF NOT EXISTS defect_default PARTITION OF Defect DEFAULT",
+        "CREATE TABLE IF NOT EXISTS defect_p2017_01 PARTITION OF Defect "
+        "FOR VALUES FROM ('2017-01-01 00:00:00+00:00') TO ('2017-02-01 00:00:00+00:00')",
+        "CREATE TABLE IF NOT EXISTS defect_p2017_02 PARTITION OF Defect "
+        "FOR VALUES FROM ('2017-02-01 00:00:00+00:00') TO ('2017-03-01 00:00:00+00:00')"]
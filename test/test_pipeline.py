@@ -0,0 +1,65 @@
+import weakref
+import threading
+import itertools
+from types import SimpleNamespace
+from rowcodec import RowCodec
+from pipeline import Pipeline
+
+codec = RowCodec('Defect', [{'ObjectID': 'INTEGER'}, {'ScheduleState': 'STATE'}])
+
+def items(count):
+    for oid in range(1, count + 1):
+        yield SimpleNamespace(ObjectID=oid, ScheduleState='Defined')
+
+def test_pages_are_written_in_order():
+    pages = []
+    pipeline = Pipeline('Defect', codec, pagesize=10, max_pages=2)
+    written = pipeline.run(items(25), pages.append)
+    assert written == 25
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [row[0] for page in pages for row in page] == list(range(1, 26))
+    assert [stage.items for stage in pipeline.stats] == [25, 25, 25, 25]
+
+def test_fetch_error_is_raised_in_writer():
+    def broken():
+        yield SimpleNamespace(ObjectID=1, ScheduleState='Defined')
+        raise ValueError('page request failed')
+    pipeline = Pipeline('Defect', codec, pagesize=1)
+    try:
+        pipeline.run(broken(), lambda rows: None)
+    except ValueError as ex:
+        assert str(ex) == 'page request failed'
+        return
+    assert False
+
+def test_items_are_dropped_once_decoded():
+    alive = []
+    class Item:
+        def __init__(self, oid):
+            self.ObjectID, self.ScheduleState = oid, 'Defined'
+            alive.append(weakref.ref(self))
+    def write(rows):
+        # the page being written is decoded: its items, and the ones of the queued pages, are gone
+        assert sum(1 for ref in alive if ref() is not None) <= 10
+    pipeline = Pipeline('Defect', codec, pagesize=10, max_pages=2)
+    assert pipeline.run((Item(oid) for oid in range(1, 101)), write) == 100
+
+def test_producer_exits_after_writer_error():
+    closed = []
+    def endless():
+        # an AC response far larger than the queue
+        try:
+            for oid in itertools.count(1):
+                yield SimpleNamespace(ObjectID=oid, ScheduleState='Defined')
+        finally:
+            closed.append(True)
+    def write(rows):
+        raise ValueError('insert failed')
+    pipeline = Pipeline('Defect', codec, pagesize=10, max_pages=2)
+    try:
+        pipeline.run(endless(), write)
+    except ValueError:
+        assert [thread for thread in threading.enumerate() if thread.name == 'fetch-Defect'] == []
+        assert closed == [True]
+        return
+    assert False
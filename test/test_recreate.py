@@ -0,0 +1,76 @@
+import json
+import pytest
+from sources import META, write_page
+from sync_state import SYNC_STATE
+from test_as_of import Connector, database
+
+# runs against the database of config.yml, like test_as_of.py; only the recreateitem table and its sync state are touched
+ENTITY = 'RecreateItem'
+
+
+class Recorder(Connector):
+    # keeps the queries the items are fetched with
+    def query_for(self, entity):
+        query = Connector.query_for(self, entity)
+        self.queries.append(query)
+        return query
+
+
+def items(*dates):
+    return [{'ObjectID': oid, 'Name': 'item %d' % oid, 'LastUpdateDate': date} for oid, date in enumerate(dates, 1)]
+
+def state(connector):
+    with connector.pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT last_update_date, last_objectid FROM " + SYNC_STATE + " WHERE entity = %s", (ENTITY,))
+        return cursor.fetchone()
+
+def drop(connector):
+    with connector.pool.connection() as db:
+        db.cursor().execute("DROP TABLE IF EXISTS recreateitem CASCADE")
+        db.commit()
+
+def create(connector):
+    connector.queries = []
+    connector.insert_init_data(connector.create_tables_n_columns())
+    with connector.pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT ObjectID FROM recreateitem ORDER BY ObjectID")
+        return [oid for oid, in cursor.fetchall()]
+
+@pytest.fixture
+def connector(tmpdir):
+    with open(str(tmpdir.join(META)), 'w') as meta:
+        json.dump({'Results': [{'ElementName': ENTITY, 'Attributes': [
+            {'ElementName': 'ObjectID', 'AttributeType': 'INTEGER'},
+            {'ElementName': 'Name', 'AttributeType': 'STRING'},
+            {'ElementName': 'LastUpdateDate', 'AttributeType': 'DATE'}]}]}, meta)
+    db = dict(database(), tables=ENTITY, pool={'min': 1, 'max': 2})
+    connector = Recorder({'ac': {'source': 'replay', 'fetch': 'ObjectID,Name,LastUpdateDate', 'query': '(Name != "")'},
+                          'replay': {'directory': str(tmpdir)}, 'db': db}, entities=[ENTITY])
+    connector.directory = str(tmpdir)
+    drop(connector)
+    connector.ensure_sync_state()
+    yield connector
+    drop(connector)
+    with connector.pool.connection() as db:
+        db.cursor().execute("DELETE FROM " + SYNC_STATE + " WHERE entity = %s", (ENTITY,))
+        db.commit()
+    connector.close()
+
+def test_create_after_drop_ignores_the_old_watermark(connector):
+    write_page(connector.directory, ENTITY, 1, items('2017-01-02T10:00:00.000Z', '2017-01-05T10:00:00.000Z'))
+    assert create(connector) == [1, 2]
+    assert state(connector) == ('2017-01-05T10:00:00.000Z', 2)
+    # the table is dropped, e.g. by utils/delete_tables.py, and created again from items older than the watermark
+    drop(connector)
+    write_page(connector.directory, ENTITY, 1, items('2017-01-01T10:00:00.000Z', '2017-01-03T10:00:00.000Z',
+                                                     '2017-01-04T10:00:00.000Z'))
+    assert create(connector) == [1, 2, 3]
+    assert connector.queries == ['(Name != "")']
+    assert state(connector) == ('2017-01-04T10:00:00.000Z', 3)
+    # a create that loads nothing does not keep the watermark of the dropped table either
+    drop(connector)
+    write_page(connector.directory, ENTITY, 1, [])
+    assert create(connector) == []
+    assert state(connector) is None
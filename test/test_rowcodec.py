@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+from datetime import datetime, timezone, timedelta
+from rowcodec import RowCodec, copy_escape
+
+columns = [{'CreationDate': 'DATE'}, {'ObjectID': 'INTEGER'}, {'ScheduleState': 'STATE'},
+           {'PlanEstimate': 'QUANTITY'}, {'Severity': 'RATING'}, {'Blocked': 'BOOLEAN'}]
+codec = RowCodec('Defect', columns)
+
+def item(**kwargs):
+    values = dict(CreationDate='2016-12-26T19:10:43.704Z', ObjectID=83320385428, ScheduleState='Defined',
+                  PlanEstimate=None, Severity='None', Blocked=False)
+    values.update(kwargs)
+    return SimpleNamespace(**values)
+
+def test_column_order():
+    assert codec.fields == ('CreationDate', 'ObjectID', 'ScheduleState', 'PlanEstimate', 'Severity', 'Blocked')
+    assert codec.columns == 'CreationDate,ObjectID,ScheduleState,PlanEstimate,Severity,Blocked'
+    assert codec.insert_sql == "INSERT INTO Defect (%s,_fingerprint) VALUES (%%s,%%s,%%s,%%s,%%s,%%s,%%s)" % codec.columns
+
+def test_encode():
+    row = codec.encode(item(PlanEstimate=2.0))
+    assert row == (datetime(2016, 12, 26, 19, 10, 43, 704000, tzinfo=timezone.utc), 83320385428, 'Defined',
+                   2.0, None, False)
+
+def test_empty_values():
+    row = codec.encode(item(ScheduleState='', Blocked=None))
+    assert row[2] is None     # empty STATE
+    assert row[3] is None     # QUANTITY None
+    assert row[4] is None     # RATING 'None'
+    assert row[5] is False    # BOOLEAN falls back to the column default
+
+def test_copy_line():
+    row = codec.encode(item(ScheduleState='In\tProgress'))
+    line = codec.copy_line(row, 'x')
+    assert line == '2016-12-26 19:10:43.704000+00:00\t83320385428\tIn\\tProgress\t\\N\t\\N\tf\tx\n'
+
+def test_copy_escape():
+    # the text format of COPY: backslash escapes, \\N for NULL, t/f, space separated timestamps, hex bytea
+    assert copy_escape('a\tb\nc\\d\re') == 'a\\tb\\nc\\\\d\\re'
+    assert copy_escape(None) == '\\N'
+    assert copy_escape('\\N') == '\\\\N'
+    assert (copy_escape(True), copy_escape(False)) == ('t', 'f')
+    assert (copy_escape(0), copy_escape(2.5)) == ('0', '2.5')
+    assert copy_escape(datetime(2017, 1, 3, 12, 0, 5, 250000, tzinfo=timezone.utc)) == '2017-01-03 12:00:05.250000+00:00'
+    assert copy_escape(b'\x00\t\\') == '\\\\x00095c'
+    assert copy_escape(memoryview(b'\xff')) == '\\\\xff'
+
+def test_copy_line_escapes_every_column():
+    row = codec.encode(item(ScheduleState='a\\b\nc', Severity='Major', PlanEstimate=1.5, Blocked=True))
+    line = codec.copy_line(row, b'\x01', datetime(2017, 1, 3, tzinfo=timezone.utc))
+    assert line.count('\t') == 7 and line.endswith('\n') and line.count('\n') == 1
+    assert line.split('\t') == ['2016-12-26 19:10:43.704000+00:00', '83320385428', 'a\\\\b\\nc', '1.5', 'Major', 't',
+                                '\\\\x01', '2017-01-03 00:00:00+00:00\n']
+
+def test_fingerprint():
+    row = codec.encode(item(PlanEstimate=2.0))
+    assert len(codec.fingerprint(row)) == 16
+    assert codec.params(row) == row + (codec.fingerprint(row),)
+    assert codec.fingerprint(row) != codec.fingerprint(codec.encode(item(PlanEstimate=3.0)))
+    # the same values read back from postgres, with the timestamp in the session time zone
+    mst = timezone(timedelta(hours=-7))
+    stored = (datetime(2016, 12, 26, 12, 10, 43, 704000, tzinfo=mst), 83320385428, 'Defined', 2.0, None, False)
+    assert codec.fingerprint(stored) == codec.fingerprint(row)
+
+def test_copy_bytea():
+    line = codec.copy_line((1,), b'\x01\xab')
+    assert line == '1\t\\\\x01ab\n'
+
+def test_immutable():
+    try:
+        codec.fields = ()
+    except AttributeError:
+        return
+    assert False
+
+def test_lookup_ids():
+    lookups = RowCodec('Defect', columns, {'ScheduleState': {'Defined': 1, 'Completed': 3}, 'Severity': {'Minor': 2}})
+    row = lookups.encode(item(PlanEstimate=2.0))
+    assert row == codec.encode(item(PlanEstimate=2.0))
+    assert lookups.params(row) == row[:2] + (1,) + row[3:] + (codec.fingerprint(row),)
+    assert lookups.copy_line(row) == '2016-12-26 19:10:43.704000+00:00\t83320385428\t1\t2.0\t\\N\tf\n'
+    try:
+        lookups.store(lookups.encode(item(ScheduleState='Accepted')))
+    except ValueError:
+        return
+    assert False
+
+def test_decode_missing_field():
+    # items without LastUpdateDate, e.g. recorded ones, decode with None for it
+    assert codec.decode(item()) == codec.decode(item(LastUpdateDate=None))
+    assert codec.decode(item(LastUpdateDate='2017-01-01T00:00:00.000Z'))[-1] == '2017-01-01T00:00:00.000Z'
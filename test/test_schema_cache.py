@@ -0,0 +1,56 @@
+import json
+from types import SimpleNamespace
+from schema_cache import TypeDef, TypedefCache
+
+def pyral_typedef(lud='2017-01-01T00:00:00.000Z'):
+    states = [SimpleNamespace(StringValue=value) for value in ('Defined', 'In-Progress', 'Completed')]
+    return SimpleNamespace(ElementName='Defect', LastUpdateDate=lud, Attributes=[
+        SimpleNamespace(ElementName='ObjectID', AttributeType='INTEGER', AllowedValues=[]),
+        SimpleNamespace(ElementName='ScheduleState', AttributeType='STATE', Constrained=True, AllowedValues=states),
+    ])
+
+class FakeAC:
+    def __init__(self, lud='2017-01-01T00:00:00.000Z'):
+        self.lud = lud
+        self.requests = []
+
+    def typedef(self, entity):
+        self.requests.append(('typedef', entity))
+        return pyral_typedef(self.lud)
+
+    def get(self, entity, **kwargs):
+        self.requests.append((entity, kwargs['query']))
+        return [SimpleNamespace(LastUpdateDate=self.lud)]
+
+def test_typedef_round_trip():
+    typedef = TypeDef.from_dict(json.loads(json.dumps(TypeDef.from_pyral(pyral_typedef()).to_dict())))
+    assert typedef.ElementName == 'Defect'
+    assert [(attr.ElementName, attr.AttributeType) for attr in typedef.Attributes] == \
+           [('ObjectID', 'INTEGER'), ('ScheduleState', 'STATE')]
+    assert [value.StringValue for value in typedef.Attributes[1].AllowedValues] == \
+           ['Defined', 'In-Progress', 'Completed']
+
+def test_cached_typedef_needs_no_requests(tmpdir):
+    ac = FakeAC()
+    TypedefCache(str(tmpdir), 'W1').get(ac, 'Defect')
+    assert ac.requests == [('typedef', 'Defect')]
+    typedef = TypedefCache(str(tmpdir), 'W1').get(ac, 'Defect')
+    assert ac.requests == [('typedef', 'Defect')]
+    assert typedef.Attributes[1].AllowedValues[0].StringValue == 'Defined'
+
+def test_expired_typedef_is_revalidated(tmpdir):
+    ac = FakeAC()
+    TypedefCache(str(tmpdir), 'W1', ttl=0).get(ac, 'Defect')
+    TypedefCache(str(tmpdir), 'W1', ttl=0).get(ac, 'Defect')
+    assert ac.requests == [('typedef', 'Defect'), ('TypeDefinition', 'ElementName = Defect')]
+    ac.lud = '2017-02-01T00:00:00.000Z'
+    typedef = TypedefCache(str(tmpdir), 'W1', ttl=0).get(ac, 'Defect')
+    assert ac.requests[-1] == ('typedef', 'Defect')
+    assert typedef.LastUpdateDate == ac.lud
+
+def test_refresh_and_workspaces(tmpdir):
+    ac = FakeAC()
+    TypedefCache(str(tmpdir), 'W1').get(ac, 'Defect')
+    TypedefCache(str(tmpdir), 'W1').get(ac, 'Defect', refresh=True)
+    TypedefCache(str(tmpdir), 'W2').get(ac, 'Defect')
+    assert ac.requests == [('typedef', 'Defect')] * 3
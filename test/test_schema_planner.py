@@ -0,0 +1,112 @@
+from schema_planner import Column, SchemaPlanner, plan_table, plan_enum, plan_lookup, plan_view, check_values
+
+columns = [Column('ID', 'SERIAL PRIMARY KEY'), Column('ObjectID', 'bigint'), Column('PlanEstimate', 'double precision'),
+           Column('Blocked', 'boolean default false'), Column('State', 'text', ['Submitted', "Won't Fix"])]
+
+def test_create_table():
+    assert plan_table('Defect', columns) == [
+        "CREATE TABLE Defect (ID SERIAL PRIMARY KEY, ObjectID bigint, PlanEstimate double precision, "
+        "Blocked boolean default false, State text, "
+        "CONSTRAINT defect_state_check CHECK (State IN ('Submitted','Won''t Fix')))"]
+
+def test_up_to_date_table():
+    existing = {'id': 'integer', 'objectid': 'bigint', 'planestimate': 'double precision', 'blocked': 'boolean',
+                'state': 'text'}
+    assert plan_table('Defect', columns, existing, {'defect_state_check': ['Submitted', "Won't Fix"]}) == []
+
+def test_alter_table():
+    existing = {'id': 'integer', 'objectid': 'integer', 'planestimate': 'double precision', 'state': 'text'}
+    assert plan_table('Defect', columns, existing, {'defect_state_check': ['Submitted']}) == [
+        "ALTER TABLE Defect ALTER COLUMN ObjectID TYPE bigint, ADD COLUMN Blocked boolean default false, "
+        "DROP CONSTRAINT defect_state_check, "
+        "ADD CONSTRAINT defect_state_check CHECK (State IN ('Submitted','Won''t Fix')) NOT VALID"]
+
+def test_no_narrowing():
+    existing = {'id': 'integer', 'objectid': 'double precision', 'planestimate': 'text', 'blocked': 'boolean',
+                'state': 'text'}
+    assert plan_table('Defect', columns, existing, {'defect_state_check': ['Submitted', "Won't Fix"]}) == []
+
+def test_check_values():
+    assert check_values("CHECK ((state = ANY (ARRAY['Submitted'::text, 'Won''t Fix'::text])))") == \
+           ['Submitted', "Won't Fix"]
+
+def test_enum():
+    assert plan_enum('defect_state', ['Submitted', 'Open']) == ["CREATE TYPE defect_state AS ENUM ('Submitted','Open')"]
+    assert plan_enum('defect_state', ['Submitted', 'Open', 'Fixed'], ['Submitted', 'Open']) == \
+           ["ALTER TYPE defect_state ADD VALUE IF NOT EXISTS 'Fixed'"]
+
+def test_lookup():
+    assert plan_lookup('defect_state_values', ['Submitted', 'Open']) == [
+        "CREATE TABLE defect_state_values (id smallint PRIMARY KEY, value text UNIQUE NOT NULL)",
+        "INSERT INTO defect_state_values (id, value) VALUES (1, 'Submitted'), (2, 'Open')"]
+    assert plan_lookup('defect_state_values', ['Submitted', 'Open', 'Fixed'], {'Submitted': 1, 'Open': 2}) == [
+        "INSERT INTO defect_state_values (id, value) VALUES (3, 'Fixed')"]
+    assert plan_lookup('defect_state_values', ['Open'], {'Submitted': 1, 'Open': 2}) == []
+
+def test_lookup_table():
+    lookup = [Column('ObjectID', 'bigint'), Column('State', 'smallint', ['Submitted'], 'lookup')]
+    assert plan_table('Defect', lookup) == [
+        "CREATE TABLE Defect (ObjectID bigint, State smallint REFERENCES defect_state_values (id))"]
+    assert plan_view('Defect', lookup) == [
+        "DROP VIEW IF EXISTS defect_decoded",
+        "CREATE VIEW defect_decoded AS SELECT t.ObjectID, _state.value AS State FROM Defect t "
+        "LEFT JOIN defect_state_values _state ON _state.id = t.State"]
+
+def test_partitioned_table():
+    partitioned = [Column('ID', 'SERIAL'), Column('_start', 'timestamp with time zone NOT NULL default now()')]
+    assert plan_table('Defect', partitioned, partition_key='_start') == [
+        "CREATE TABLE Defect (ID SERIAL, _start timestamp with time zone NOT NULL default now(), "
+        "PRIMARY KEY (ID, _start)) PARTITION BY RANGE (_start)"]
+    assert plan_table('Defect', partitioned, {'id': 'integer', '_start': 'time with time zone'}) == [
+        "ALTER TABLE Defect ALTER COLUMN _start TYPE timestamp with time zone USING current_date + _start"]
+
+def test_generated_column():
+    valid = Column('_valid', 'tstzrange GENERATED ALWAYS AS (tstzrange(least(_start, _end), _end)) STORED')
+    assert valid.data_type() == 'tstzrange'
+    assert plan_table('Defect', [valid], {'_valid': 'tstzrange'}) == []
+    assert plan_table('Defect', [valid], {'id': 'integer'}) == [
+        "ALTER TABLE Defect ADD COLUMN _valid tstzrange GENERATED ALWAYS AS (tstzrange(least(_start, _end), _end)) STORED"]
+
+
+class FakeCursor:
+    # the catalog queries of SchemaPlanner on a database holding the enum types and lookup tables of `catalog`
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.result  = None
+
+    def execute(self, sql, params=None):
+        if 'pg_enum' in sql:
+            self.result = [(label,) for label in self.catalog[params[0]]]
+        elif 'IS NOT NULL' in sql:
+            self.result = [(params[0] in self.catalog,)]
+        elif sql.startswith('SELECT value, id FROM '):
+            self.result = list(self.catalog[sql.split()[-1]].items())
+        else:
+            self.result = []
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+def test_split_tables_share_enum_types():
+    columns = [Column('ObjectID', 'bigint'), Column('State', 'defect_state', ['Submitted', 'Open'], 'enum', 'Defect')]
+    statements, created = SchemaPlanner(FakeCursor({})).plan('Defect', columns)
+    assert statements[0] == "CREATE TYPE defect_state AS ENUM ('Submitted','Open')" and created
+    # the history table uses the type of the entity
+    statements, created = SchemaPlanner(FakeCursor({'defect_state': ['Submitted', 'Open']})).plan('Defect_history', columns)
+    assert statements == ["CREATE TABLE Defect_history (ObjectID bigint, State defect_state)"]
+
+def test_split_tables_share_lookup_tables():
+    columns = [Column('ObjectID', 'bigint'), Column('State', 'smallint', ['Submitted', 'Open'], 'lookup', 'Defect')]
+    statements, created = SchemaPlanner(FakeCursor({})).plan('Defect', columns)
+    assert statements[:2] == plan_lookup('defect_state_values', ['Submitted', 'Open'])
+    # the history table references, and its view decodes through, the lookup table of the entity
+    catalog = {'defect_state_values': {'Submitted': 1, 'Open': 2}}
+    statements, created = SchemaPlanner(FakeCursor(catalog)).plan('Defect_history', columns)
+    assert statements == [
+        "CREATE TABLE Defect_history (ObjectID bigint, State smallint REFERENCES defect_state_values (id))",
+        "DROP VIEW IF EXISTS defect_history_decoded",
+        "CREATE VIEW defect_history_decoded AS SELECT t.ObjectID, _state.value AS State FROM Defect_history t "
+        "LEFT JOIN defect_state_values _state ON _state.id = t.State"]
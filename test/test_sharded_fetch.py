@@ -0,0 +1,58 @@
+import threading
+import time
+from types import SimpleNamespace
+from sharded_fetch import ShardedFetch, shard_ranges, shard_query
+
+
+class FakeAC:
+    # answers ac.get for ObjectIDs 1..n the way WSAPI would for the queries ShardedFetch issues
+    def __init__(self, oids):
+        self.oids = sorted(oids)
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def get(self, entity, fetch, query, order, pagesize, limit=None):
+        with self.lock:
+            self.calls.append(query)
+        oids = self.oids
+        if isinstance(query, list):
+            low  = int(query[-2].split()[-1])
+            high = int(query[-1].split()[-1])
+            oids = [oid for oid in oids if low <= oid < high]
+        if order == 'ObjectID desc':
+            oids = list(reversed(oids))
+        if limit:
+            oids = oids[:limit]
+        return self.items(oids)
+
+    def items(self, oids):
+        for oid in oids:
+            time.sleep(0.0001)
+            yield SimpleNamespace(ObjectID=oid)
+
+
+def test_shard_ranges():
+    assert shard_ranges(1, 100, 4) == [(1, 26), (26, 51), (51, 76), (76, 101)]
+    assert shard_ranges(5, 6, 4) == [(5, 6), (6, 7)]
+    assert shard_ranges(7, 7, 3) == [(7, 8)]
+
+def test_shard_query():
+    assert shard_query('LastUpdateDate >= 2015-06-01', 1, 10) == \
+           ['LastUpdateDate >= 2015-06-01', 'ObjectID >= 1', 'ObjectID < 10']
+    assert shard_query(None, 1, 10) == ['ObjectID >= 1', 'ObjectID < 10']
+
+def test_merged_output_is_ordered():
+    oids = [3, 17, 18, 40, 41, 42, 99, 250, 251, 1000]
+    ac = FakeAC(oids)
+    fetch = ShardedFetch(ac, 'Defect', 'ObjectID', 'LastUpdateDate >= 2015-06-01', shards=4, concurrency=2,
+                         pagesize=1, max_pages=1)
+    assert [item.ObjectID for item in fetch] == oids
+    assert len(ac.calls) == 2 + 4
+
+def test_empty_result():
+    assert list(ShardedFetch(FakeAC([]), 'Defect', 'ObjectID', None)) == []
+
+def test_decoded_shards():
+    fetch = ShardedFetch(FakeAC(range(1, 101)), 'Defect', 'ObjectID', 'x', shards=4, pagesize=10,
+                         decode=lambda item: (item.ObjectID, None))
+    assert list(fetch) == [(oid, None) for oid in range(1, 101)]
@@ -0,0 +1,47 @@
+import json
+from rowcodec import RowCodec
+from sources import ReplaySource, page_files, write_page, META
+
+codec = RowCodec('Defect', [{'ObjectID': 'INTEGER'}, {'ScheduleState': 'STATE'}, {'LastUpdateDate': 'DATE'}])
+
+def result(oid):
+    return {'ObjectID': oid, 'ScheduleState': 'Defined', 'LastUpdateDate': '2017-01-01T00:00:00.000Z'}
+
+def record(directory, count, pagesize, compress=False):
+    # pages of `pagesize` items, the last one shorter; the numbering goes past 9 to check the page order
+    with open(str(directory.join(META)), 'w') as meta:
+        json.dump({'Results': [{'Name': 'Defect', 'Attributes': [{'ElementName': 'ObjectID', 'AttributeType': 'INTEGER'},
+                                                                  {'ElementName': 'ScheduleState', 'AttributeType': 'STATE',
+                                                                   'AllowedValues': ['Defined', 'Accepted']}]}]}, meta)
+    for index, low in enumerate(range(1, count + 1, pagesize)):
+        write_page(str(directory), 'Defect', index, [result(oid) for oid in range(low, min(low + pagesize, count + 1))],
+                   compress)
+
+def test_page_files_are_in_page_order(tmpdir):
+    record(tmpdir, 25, 2)
+    tmpdir.join('Defect_snapshots_0.json').write('{}')
+    assert [path.rsplit('_', 1)[1] for path in page_files(str(tmpdir), 'Defect')] == \
+           ['%d.json' % index for index in range(13)]
+
+def test_typedef_from_meta(tmpdir):
+    record(tmpdir, 1, 1)
+    typedef = ReplaySource(str(tmpdir)).typedef('Defect')
+    assert typedef.ElementName == 'Defect'
+    assert [(attr.ElementName, attr.AttributeType) for attr in typedef.Attributes] == \
+           [('ObjectID', 'INTEGER'), ('ScheduleState', 'STATE')]
+    assert [value.StringValue for value in typedef.Attributes[1].AllowedValues] == ['Defined', 'Accepted']
+
+def test_items_are_replayed_decoded(tmpdir):
+    record(tmpdir, 25, 10, compress=True)
+    source = ReplaySource(str(tmpdir))
+    items = list(source.items('Defect', codec, 'ignored = query'))
+    assert [item[0] for item in items] == list(range(1, 26))
+    assert items[0] == (1, 'Defined', '2017-01-01T00:00:00.000Z')
+    assert list(source.objectids('Defect', None)) == list(range(1, 26))
+
+def test_pages_across_recorded_files(tmpdir):
+    record(tmpdir, 25, 10)
+    source = ReplaySource(str(tmpdir), pagesize=7)
+    pages = [source.page('Defect', codec, None, start) for start in range(1, 26, 7)]
+    assert [total for total, raws in pages] == [25] * 4
+    assert [raw[0] for total, raws in pages for raw in raws] == list(range(1, 26))
@@ -0,0 +1,21 @@
+from rowcodec import RowCodec
+from split_layout import split_statements, move_deleted_sql
+
+codec = RowCodec('Defect', [{'ObjectID': 'INTEGER'}, {'ScheduleState': 'STATE'}])
+
+def test_split_statements():
+    archive_sql, upsert_sql = split_statements('Defect', 'Defect_history', codec, '_stage_Defect')
+    assert archive_sql == ("INSERT INTO Defect_history (ObjectID,ScheduleState,_fingerprint,_start,_end) "
+                           "SELECT t.ObjectID,t.ScheduleState,t._fingerprint,t._start,%(now)s FROM Defect t "
+                           "JOIN _stage_Defect s ON t.ObjectID = s.ObjectID WHERE t._fingerprint IS DISTINCT FROM s._fingerprint")
+    assert upsert_sql == ("INSERT INTO Defect (ObjectID,ScheduleState,_fingerprint,_start) "
+                          "SELECT s.ObjectID,s.ScheduleState,s._fingerprint,%(now)s FROM _stage_Defect s "
+                          "ON CONFLICT (ObjectID) DO UPDATE SET ObjectID = EXCLUDED.ObjectID,"
+                          "ScheduleState = EXCLUDED.ScheduleState,_fingerprint = EXCLUDED._fingerprint,"
+                          "_start = EXCLUDED._start WHERE Defect._fingerprint IS DISTINCT FROM EXCLUDED._fingerprint")
+
+def test_move_deleted_sql():
+    assert move_deleted_sql('Defect', 'Defect_history', codec) == (
+        "WITH gone AS (DELETE FROM Defect WHERE id = ANY(%s) RETURNING ObjectID,ScheduleState,_fingerprint,_start) "
+        "INSERT INTO Defect_history (ObjectID,ScheduleState,_fingerprint,_start,_end,_deleted) "
+        "SELECT ObjectID,ScheduleState,_fingerprint,_start,%s,true FROM gone")
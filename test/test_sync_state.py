@@ -0,0 +1,26 @@
+from rowcodec import RowCodec
+from sync_state import Watermark
+
+codec = RowCodec('Defect', [{'ObjectID': 'INTEGER'}, {'ScheduleState': 'STATE'}])
+
+def test_observe_keeps_the_highest_mark():
+    watermark = Watermark('Defect')
+    watermark.observe(codec, [(11, 'Defined', '2017-01-02T10:00:00.000Z'), (12, 'Defined', '2017-01-03T09:00:00.000Z')])
+    watermark.observe(codec, [(13, 'Defined', '2017-01-01T00:00:00.000Z'), (14, 'Defined', None)])
+    assert (watermark.last_update_date, watermark.last_objectid) == ('2017-01-03T09:00:00.000Z', 12)
+    watermark.observe(codec, [(15, 'Defined', '2017-01-03T09:00:00.000Z')])
+    assert watermark.last_objectid == 15
+
+def test_query_without_watermark():
+    assert Watermark('Defect').query('LastUpdateDate >= 2015-06-01', 300) == 'LastUpdateDate >= 2015-06-01'
+
+def test_query_with_overlap():
+    watermark = Watermark('Defect', '2017-01-03T09:00:00.000Z', 15)
+    assert watermark.query('LastUpdateDate >= 2015-06-01', 300) == \
+           ['LastUpdateDate >= 2015-06-01', 'LastUpdateDate >= 2017-01-03T08:55:00.000Z']
+
+def test_query_with_objectid_tiebreak():
+    watermark = Watermark('Defect', '2017-01-03T09:00:00.000Z', 15)
+    assert watermark.query(None, 0) == \
+           ['((LastUpdateDate > 2017-01-03T09:00:00.000Z) OR '
+            '((LastUpdateDate = 2017-01-03T09:00:00.000Z) AND (ObjectID > 15)))']
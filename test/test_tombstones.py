@@ -0,0 +1,18 @@
+from tombstones import anti_join, batched
+
+def test_anti_join():
+    open_rows = [(1, 10), (2, 20), (3, 30), (4, 40), (5, 50)]
+    assert list(anti_join(open_rows, [10, 15, 30, 50, 60])) == [(2, 20), (4, 40)]
+
+def test_anti_join_exhausted_oids():
+    assert list(anti_join([(1, 10), (2, 20), (3, 30)], [10])) == [(2, 20), (3, 30)]
+
+def test_anti_join_streams():
+    open_rows = ((oid, oid) for oid in range(0, 1000000, 2))
+    oids = (oid for oid in range(0, 1000000, 4))
+    missing = anti_join(open_rows, oids)
+    assert next(missing) == (2, 2)
+    assert sum(1 for _ in missing) == 249999
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,71 @@
+import json
+from urllib.parse import urlencode
+from rowcodec import RowCodec
+from wsapi_json import WsapiJson, wsapi_query
+
+codec = RowCodec('Defect', [{'ObjectID': 'INTEGER'}, {'ScheduleState': 'STATE'}, {'LastUpdateDate': 'DATE'}])
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.content = json.dumps(body).encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    # answers WSAPI queries for ObjectIDs 1..n from pages of `pagesize` dicts
+    def __init__(self, count):
+        self.count = count
+        self.requests = []
+
+    def get(self, url, params):
+        self.requests.append((url, params))
+        start, pagesize = params['start'], params['pagesize']
+        results = [{'_ref': '/defect/%s' % oid, 'ObjectID': oid, 'ScheduleState': 'Defined',
+                    'LastUpdateDate': '2017-01-01T00:00:00.000Z'}
+                   for oid in range(start, min(start + pagesize, self.count + 1))]
+        return FakeResponse({'QueryResult': {'Errors': [], 'TotalResultCount': self.count, 'Results': results}})
+
+
+class FakeContext:
+    def currentWorkspaceRef(self):
+        return '/workspace/1'
+
+    def currentProjectRef(self):
+        return '/project/2'
+
+
+class FakeAC:
+    def __init__(self, count):
+        self.session = FakeSession(count)
+        self.service_url = 'https://rally1.rallydev.com/slm/webservice/v2.0'
+        self.contextHelper = FakeContext()
+
+
+def test_wsapi_query():
+    assert wsapi_query(None) is None
+    assert wsapi_query('ObjectID > 5') == '(ObjectID > 5)'
+    assert wsapi_query(['A = 1', 'B = 2', '((C = 3) OR (D = 4))']) == '(((A = 1) AND (B = 2)) AND ((C = 3) OR (D = 4)))'
+
+def test_pages_are_requested_until_the_total():
+    ac = FakeAC(25)
+    wsapi = WsapiJson(ac)
+    items = list(wsapi.get('Defect', fetch=codec.fetch, query='ScheduleState = Defined', order='ObjectID',
+                           pagesize=10, decode=codec.decode_json))
+    assert [item[0] for item in items] == list(range(1, 26))
+    assert items[0] == (1, 'Defined', '2017-01-01T00:00:00.000Z')
+    assert [params['start'] for url, params in ac.session.requests] == [1, 11, 21]
+    url, params = ac.session.requests[0]
+    assert url == 'https://rally1.rallydev.com/slm/webservice/v2.0/defect'
+    assert urlencode(sorted(params.items())) == urlencode(sorted({
+        'fetch': 'ObjectID,ScheduleState,LastUpdateDate', 'query': '(ScheduleState = Defined)', 'order': 'ObjectID',
+        'pagesize': 10, 'start': 1, 'workspace': '/workspace/1', 'project': '/project/2'}.items()))
+
+def test_limit():
+    wsapi = WsapiJson(FakeAC(25))
+    assert [item['ObjectID'] for item in wsapi.get('Defect', 'ObjectID', order='ObjectID', pagesize=10, limit=1)] == [1]
+
+def test_missing_field_decodes_to_none():
+    assert codec.decode_json({'ObjectID': 7, 'LastUpdateDate': None}) == (7, None, None)
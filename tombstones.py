@@ -0,0 +1,22 @@
+def anti_join(open_rows, oids):
+    """
+    Merge anti-join of two ObjectID-ordered streams: yields the (id, ObjectID) open rows
+    whose ObjectID does not occur in `oids`. Holds one element of each stream at a time.
+    """
+    oids = iter(oids)
+    current = next(oids, None)
+    for id, oid in open_rows:
+        while current is not None and current < oid:
+            current = next(oids, None)
+        if current != oid:
+            yield id, oid
+
+def batched(iterable, size):
+    batch = []
+    for element in iterable:
+        batch.append(element)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
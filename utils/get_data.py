@@ -1,7 +1,8 @@
 import psycopg2
 from psycopg2.extensions import AsIs
-import yaml
 import pytest
+from dbpool import get_pool
+from dbconnector import read_config
 
 '''
 to list of db tables in terminal:
@@ -9,8 +10,7 @@ to list of db tables in terminal:
     rally=# \d
 '''
 
-with open('config.yml', 'r') as file:
-    config = yaml.load(file)
+config = read_config('config.yml')
 
 DB   = config['db']['name']
 USER = config['db']['user']
@@ -18,19 +18,8 @@ PASS = config['db']['password']
 HOST = config['db']['host']
 PORT = config['db']['port']
 
-def connect_db(dbname):
-    con = None # to avoid "local variable con might be referenced before assignement
-    try:
-        con = psycopg2.connect(database=dbname, user=USER, password=PASS, host=HOST, port=PORT)
-    except psycopg2.Error as e:
-        print("oh, noes! " + e.pgerror)
-    finally:
-        return con
-
-
 def get_tables(dbname):
-    con = connect_db(dbname)
-    if con:
+    with get_pool(config['db'], database=dbname).connection() as con:
         cur = con.cursor()
         tables = []
         try:
@@ -39,13 +28,10 @@ def get_tables(dbname):
         except psycopg2.Error as e:
             print("oh, noes! " + e.pgerror)
         finally:
-            if con:
-                con.close()
-                return tables
+            return tables
 
 def get_columns(dbname, table):
-    con = connect_db(dbname)
-    if con:
+    with get_pool(config['db'], database=dbname).connection() as con:
         cur = con.cursor()
         columns = []
         try:
@@ -54,9 +40,7 @@ def get_columns(dbname, table):
         except psycopg2.Error as e:
             print("oh, noes! " + e.pgerror)
         finally:
-            if con:
-                con.close()
-                return columns
+            return columns
 
 def test_get_tables():
     tables = get_tables(DB)
@@ -1,9 +1,8 @@
 import pyral
-import yaml
 from pyral import Rally, rallyWorkset, RallyRESTAPIError
+from dbconnector import read_config
 
-with open('config.yml', 'r') as file:
-    config = yaml.load(file)
+config = read_config('config.yml')
 
 USER      = config['ac']['user']
 PASS      = config['ac']['password']
@@ -1,11 +1,10 @@
 import sys
-import yaml
 from pyral import Rally, rallyWorkset, RallyRESTAPIError
+from dbconnector import read_config
 
 errout = sys.stderr.write
 
-with open('config.yml', 'r') as file:
-    config = yaml.load(file)
+config = read_config('config.yml')
 
 some_workitems   = config['db']['tables']
 some_attributes  = config['ac']['fetch']
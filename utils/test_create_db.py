@@ -1,5 +1,6 @@
 import psycopg2
-import yaml
+from dbpool import get_pool
+from dbconnector import read_config
 
 '''
 to check outcomes in terminal:
@@ -7,8 +8,7 @@ to check outcomes in terminal:
     bash-3.2$ psql -l
 '''
 
-with open('config.yml', 'r') as file:
-    config = yaml.load(file)
+config = read_config('config.yml')
 
 USER = config['db']['user']
 PASS = config['db']['password']
@@ -17,10 +17,9 @@ PORT = config['db']['port']
 
 
 def create_db(dbname):
-    with psycopg2.connect(database="postgres", user=USER, password=PASS, host=HOST, port=PORT) as conn:
+    # CREATE/DROP DATABASE run against the maintenance db, outside of a transaction block
+    with get_pool(config['db'], database="postgres").connection(autocommit=True) as conn:
         with conn.cursor() as cur:
-            # use set_isolation_level(0) to avoid psycopg2.InternalError: CREATE DATABASE cannot run inside a transaction block
-            conn.set_isolation_level(0)
             cur.execute('CREATE DATABASE ' + dbname)
             cur.close()
     return True
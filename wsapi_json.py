@@ -0,0 +1,92 @@
+import json
+import threading
+from pyral import RallyRESTAPIError
+
+# the fastest JSON parser available; all of them take the raw bytes of a response
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        loads = ujson.loads
+    except ImportError:
+        loads = json.loads
+
+
+def wsapi_query(query):
+    """
+    The WSAPI query expression of a query given like to ac.get: a condition or a list of
+    conditions that are ANDed. WSAPI only takes binary expressions, so the conditions are
+    grouped pairwise: ((A) AND (B)) AND (C) is sent as (((A) AND (B)) AND (C)).
+    A condition starting with '(' is taken to be grouped already.
+    """
+    conditions = list(query) if isinstance(query, (list, tuple)) else ([query] if query else [])
+    expression = None
+    for condition in conditions:
+        condition = condition.strip()
+        if not condition.startswith('('):
+            condition = '(%s)' % condition
+        expression = condition if expression is None else '(%s AND %s)' % (expression, condition)
+    return expression
+
+
+class WsapiJson:
+    """
+    Paged WSAPI queries issued on the authenticated session of a pyral Rally connection, with
+    the results left as the dicts of the JSON response (ac.backend: json). pyral is only used
+    to log in and resolve the workspace and project; no entity objects are built for the items.
+    """
+    def __init__(self, ac):
+        self.session   = ac.session
+        self.url       = ac.service_url
+        self.workspace = ac.contextHelper.currentWorkspaceRef()
+        self.project   = ac.contextHelper.currentProjectRef()
+        self.received  = {}    # bytes of the responses per entity
+        self.lock      = threading.Lock()
+
+    def request(self, entity, fetch, query, order, pagesize, start):
+        params = {'fetch': fetch, 'pagesize': pagesize, 'start': start}
+        expression = wsapi_query(query)
+        if expression:
+            params['query'] = expression
+        if order:
+            params['order'] = order
+        if self.workspace:
+            params['workspace'] = self.workspace
+        if self.project:
+            params['project'] = self.project
+        response = self.session.get('%s/%s' % (self.url, entity.lower()), params=params)
+        response.raise_for_status()
+        with self.lock:
+            self.received[entity] = self.received.get(entity, 0) + len(response.content)
+        result = loads(response.content)['QueryResult']
+        if result.get('Errors'):
+            raise RallyRESTAPIError('%s: %s' % (entity, '; '.join(result['Errors'])))
+        return result
+
+    def pages(self, entity, fetch, query=None, order='ObjectID', pagesize=200, limit=None):
+        # the Results of each page, until TotalResultCount (or `limit`) items are read
+        start, read = 1, 0
+        while True:
+            result = self.request(entity, fetch, query, order, pagesize, start)
+            page = result['Results']
+            if limit is not None:
+                page = page[:limit - read]
+            count = len(page)
+            if page:
+                yield page
+            read += count
+            start += pagesize
+            if not count or start > int(result['TotalResultCount']) or (limit is not None and read >= limit):
+                break
+
+    def get(self, entity, fetch=None, query=None, order=None, pagesize=200, limit=None, decode=None):
+        """
+        The items of the query like ac.get(...), as dicts, or as decode(dict) (RowCodec.decode_json)
+        when given. A page is released as soon as its items are handed out.
+        """
+        for page in self.pages(entity, fetch or 'ObjectID', query, order, pagesize, limit):
+            for result in page:
+                yield decode(result) if decode else result
+            del page[:]